@@ -1,9 +1,11 @@
 import os
 import time
 import logging
+from contextlib import contextmanager
+from typing import Iterator
 
 from sqlalchemy import create_engine, Engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 from .models import Base
 
@@ -35,6 +37,9 @@ def get_pg_conn() -> Engine:
     engine = create_engine(
         f"postgresql+psycopg2://{db_user}:{db_password}@{db_host}/{db_name}",
         client_encoding="utf8",
+        pool_size=10,
+        max_overflow=20,
+        pool_pre_ping=True,
     )
 
     return engine
@@ -74,6 +79,23 @@ class WithDB:
         finally:
             db.close()
 
+    @staticmethod
+    @contextmanager
+    def _session() -> Iterator[Session]:
+        """Get a database session which is closed on exit
+
+        Example:
+            ```
+            with self._session() as session:
+                session.add(foo)
+            ```
+        """
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
 
 def get_db():
     """Get a database connection
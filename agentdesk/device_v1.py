@@ -4,6 +4,7 @@ import base64
 import io
 import json
 import urllib.parse
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import Enum
 from typing import Any, List, Optional, Tuple, Type
 
@@ -120,6 +121,7 @@ class Desktop(Device):
             check_health (bool, optional): Whether to check the health of the server. Defaults to True.
         """
         super().__init__()
+        self._executor = ThreadPoolExecutor(max_workers=2)
         self._instance = instance
         self._agentd_url = agentd_url
         self.api_key = api_key
@@ -141,7 +143,7 @@ class Desktop(Device):
                     raise ValueError(f"No key found with name {self._key_pair_name}")
                 key_pair = keys[0]
 
-                private_ssh_key = key_pair.decrypt_private_key(key_pair.private_key)
+                private_ssh_key = key_pair.decrypted_private_key
 
         else:
             self.base_url = agentd_url
@@ -428,7 +430,7 @@ class Desktop(Device):
                 raise ValueError(f"No key found with name {self._key_pair_name}")
             key_pair = keys[0]
 
-            ssh_private_key = key_pair.decrypt_private_key(key_pair.private_key)
+            ssh_private_key = key_pair.decrypted_private_key
         instance = self._instance
         if isinstance(instance, DesktopInstance):
             instance = instance.to_v1_schema()
@@ -540,6 +542,21 @@ class Desktop(Device):
 
         self._instance.view(background)
 
+    def view_async(self, background: bool = True) -> Future:
+        """View the desktop without blocking the caller
+
+        Args:
+            background (bool, optional): Whether to run in the background and not block. Defaults to True.
+
+        Returns:
+            Future: A future which resolves once the view is set up
+        """
+
+        if not self._instance:
+            raise ValueError("Desktop not created with a VM, don't know how to proxy")
+
+        return self._executor.submit(self._instance.view, background)
+
     def health(self) -> dict:
         """Health of agentd
 
@@ -801,7 +818,7 @@ class Desktop(Device):
         return jdict["x"], jdict["y"]
 
     def close(self):
-        pass
+        self._executor.shutdown(wait=False, cancel_futures=True)
 
     def demostrate(
         self,
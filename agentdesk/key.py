@@ -1,4 +1,5 @@
 from dataclasses import dataclass, field
+import functools
 from typing import List, Optional, Dict
 import uuid
 import time
@@ -16,6 +17,11 @@ from agentdesk.db.conn import WithDB
 from agentdesk.server.models import V1SSHKey
 
 
+@functools.lru_cache(maxsize=4)
+def _fernet(key: bytes) -> Fernet:
+    return Fernet(key)
+
+
 @dataclass
 class SSHKeyPair(WithDB):
     """An SSH key"""
@@ -70,17 +76,22 @@ class SSHKeyPair(WithDB):
 
     def encrypt_private_key(self, private_key: str) -> str:
         key = self.get_encryption_key()
-        fernet = Fernet(key)
+        fernet = _fernet(key)
         encrypted_private_key = fernet.encrypt(private_key.encode())
         return base64.b64encode(encrypted_private_key).decode()
 
     @classmethod
     def decrypt_private_key(cls, encrypted_private_key: str) -> str:
         key = cls.get_encryption_key()
-        fernet = Fernet(key)
+        fernet = _fernet(key)
         decrypted_private_key = fernet.decrypt(base64.b64decode(encrypted_private_key))
         return decrypted_private_key.decode()
 
+    @functools.cached_property
+    def decrypted_private_key(self) -> str:
+        """The private key in plain text, decrypted once per key pair"""
+        return self.decrypt_private_key(self.private_key)
+
     @classmethod
     def generate_key(
         cls,
@@ -176,5 +187,5 @@ class SSHKeyPair(WithDB):
             public_key=self.public_key,
             name=self.name,
             created=self.created,
-            private_key=self.decrypt_private_key(self.private_key),
+            private_key=self.decrypted_private_key,
         )
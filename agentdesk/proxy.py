@@ -270,6 +270,14 @@ def cleanup_proxy(pid: int, log_error: bool = True) -> None:
             )
 
 
+def proxy_alive(pid: int) -> bool:
+    """Check whether the SSH proxy process with the given PID is still running."""
+    try:
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.Error:
+        return False
+
+
 def ensure_ssh_proxy(
     local_port: int = 6080,
     remote_port: int = 6080,
@@ -1,4 +1,9 @@
 from .qemu import QemuProvider
-from .base import DesktopProvider, DesktopInstance
+from .base import DesktopProvider, DesktopInstance, WaitForReadyOptions
 
-__all__ = ["DesktopProvider", "DesktopInstance", "QemuProvider"]
+__all__ = [
+    "DesktopProvider",
+    "DesktopInstance",
+    "QemuProvider",
+    "WaitForReadyOptions",
+]
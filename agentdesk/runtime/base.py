@@ -2,32 +2,250 @@ from __future__ import annotations
 
 import atexit
 import base64
+import contextlib
+import functools
 import json
+import logging
 import os
 import random
+import threading
 import time
 import webbrowser
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Generic, List, Optional, TypeVar
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 
-import docker
+import requests
 import shortuuid
 from cryptography.fernet import Fernet
-from docker.models.containers import Container
+from sqlalchemy import delete as sql_delete
+from sqlalchemy import bindparam, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import raiseload
 
 from agentdesk.db.conn import WithDB
 from agentdesk.db.models import V1DesktopRecord
 from agentdesk.key import SSHKeyPair
-from agentdesk.proxy import cleanup_proxy, ensure_ssh_proxy
+from agentdesk.proxy import cleanup_proxy, ensure_ssh_proxy, proxy_alive
 from agentdesk.server.models import V1DesktopInstance, V1ProviderData
 from agentdesk.util import (
     check_command_availability,
     check_port_in_use,
     get_docker_host,
+    get_free_port,
+    retrying_session,
+    tcp_port_open,
+    wait_for_http,
 )
 
+if TYPE_CHECKING:
+    import docker
+    from docker.models.containers import Container
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> str:
+        # json.dumps stringifies non-str keys, keep that behavior
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    _loads = orjson.loads
+except ImportError:
+    _dumps = json.dumps
+    _loads = json.loads
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_provider(raw: str) -> V1ProviderData:
+    """Parse stored provider data, the result is shared so callers must copy it"""
+    return V1ProviderData.model_validate_json(raw)
+
+
 UI_IMG = "us-central1-docker.pkg.dev/agentsea-dev/agentdesk/ui:634820941cbbba4b3cd51149b25d0a4c8d1a35f4"
+UI_LABELS = {"agentdesk.role": "ui", "agentdesk.ui_img": UI_IMG}
+
+_UPSERT_STMTS: Dict[str, Any] = {}
+
+
+def _upsert_stmt(dialect: str) -> Any:
+    """Get an insert-or-update statement for desktop records on the given dialect"""
+    stmt = _UPSERT_STMTS.get(dialect)
+    if stmt is not None:
+        return stmt
+
+    table = V1DesktopRecord.__table__
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={c.name: stmt.excluded[c.name] for c in table.c if c.name != "id"},
+    )
+    _UPSERT_STMTS[dialect] = stmt
+    return stmt
+
+
+# Columns of a desktop record which make up its V1 schema
+_V1_COLUMNS = (
+    V1DesktopRecord.id,
+    V1DesktopRecord.name,
+    V1DesktopRecord.addr,
+    V1DesktopRecord.status,
+    V1DesktopRecord.created,
+    V1DesktopRecord.assigned,
+    V1DesktopRecord.memory,
+    V1DesktopRecord.cpu,
+    V1DesktopRecord.disk,
+    V1DesktopRecord.image,
+    V1DesktopRecord.reserved_ip,
+    V1DesktopRecord.provider,
+    V1DesktopRecord.meta,
+    V1DesktopRecord.owner_id,
+    V1DesktopRecord.key_pair_name,
+    V1DesktopRecord.agentd_port,
+    V1DesktopRecord.vnc_port,
+    V1DesktopRecord.vnc_port_https,
+    V1DesktopRecord.basic_auth_user,
+    V1DesktopRecord.basic_auth_password,
+    V1DesktopRecord.resource_name,
+    V1DesktopRecord.namespace,
+    V1DesktopRecord.ttl,
+    V1DesktopRecord.requires_proxy,
+)
+
+# Record columns which map one to one onto DesktopInstance attributes
+_RECORD_FIELDS = (
+    "id",
+    "name",
+    "addr",
+    "cpu",
+    "created",
+    "assigned",
+    "memory",
+    "disk",
+    "pid",
+    "status",
+    "image",
+    "reserved_ip",
+    "requires_proxy",
+    "ssh_port",
+    "owner_id",
+    "key_pair_name",
+    "agentd_port",
+    "vnc_port",
+    "vnc_port_https",
+    "basic_auth_user",
+    "resource_name",
+    "namespace",
+    "ttl",
+)
+
+# Statements built once at import so their compiled form is reused per call.
+# Records are read whole by from_record, relationships must be loaded
+# explicitly so a lazy load can't turn a listing into one query per row
+_SELECT_RECORDS = select(V1DesktopRecord).options(raiseload("*"))
+_SELECT_BY_ID = _SELECT_RECORDS.where(V1DesktopRecord.id == bindparam("id"))
+_SELECT_BY_NAME = _SELECT_RECORDS.where(
+    V1DesktopRecord.name == bindparam("name"),
+    V1DesktopRecord.owner_id.is_not_distinct_from(bindparam("owner_id")),
+)
+_EXISTS_BY_NAME = select(_SELECT_BY_NAME.exists())
+_TAKEN_NAMES = select(V1DesktopRecord.name).where(
+    V1DesktopRecord.name.in_(bindparam("names", expanding=True))
+)
+_DELETE_BY_ID = sql_delete(V1DesktopRecord.__table__).where(
+    V1DesktopRecord.id == bindparam("id")
+)
+# Prefixes of a provider stored as JSON, by model_dump_json and by json.dumps
+_PROVIDER_TYPE_PATTERNS = ('{{"type":"{}"%', '{{"type": "{}"%')
+
+
+@functools.lru_cache(maxsize=1)
+def _docker_client() -> docker.DockerClient:
+    """Docker client for the current docker context, created once per process"""
+    import docker
+
+    os.environ["DOCKER_HOST"] = get_docker_host()
+    return docker.from_env()
+
+
+def _ensure_ui_container() -> Tuple[int, Container]:
+    """Find the running UI container or start one, returns its host port"""
+    check_command_availability("docker")
+
+    import docker
+
+    client = _docker_client()
+
+    # The daemon resolves image ancestry, which also finds UI containers
+    # started before they were labeled. Sparse listing keeps the summary
+    # the daemon already sent instead of inspecting every match
+    for container in client.containers.list(filters={"ancestor": UI_IMG}, sparse=True):
+        # Retrieve the host port for the existing container
+        for port in container.attrs.get("Ports", []):
+            if port.get("PrivatePort") == 3000 and port.get("PublicPort"):
+                logger.debug("found running UI container %s", container.id)
+                return port["PublicPort"], container
+
+    print("creating UI container...")
+    # The port is free when probed but may be taken before docker binds it
+    for attempt in range(3):
+        host_port = get_free_port()
+        try:
+            ui_container = client.containers.run(
+                UI_IMG, ports={"3000/tcp": host_port}, labels=UI_LABELS, detach=True
+            )
+            break
+        except docker.errors.APIError as e:
+            if attempt == 2 or "port is already allocated" not in str(e):
+                raise
+            logger.debug("port %s was taken, retrying", host_port)
+
+    print("waiting for UI container to start...")
+    start = time.monotonic()
+    if wait_for_http(f"http://localhost:{host_port}"):
+        print(f"UI container ready in {time.monotonic() - start:.1f}s")
+    else:
+        print("UI container did not become ready in time")
+    return host_port, ui_container  # type: ignore
+
+
+def _stop_ui_container(container: Container) -> None:
+    import docker
+
+    try:
+        print("stopping UI container...")
+        container.stop(timeout=1)
+        print("removing UI container...")
+        container.remove()
+    except docker.errors.NotFound:
+        print("UI container already stopped/removed.")
+    except docker.errors.APIError as e:
+        # 409 means the container is already being removed
+        if e.status_code != 409:
+            raise
+
+
+def _stop_proxy(pid: int) -> None:
+    try:
+        print("stopping ssh proxy...")
+        cleanup_proxy(pid)
+    except Exception as e:
+        print(f"Error stopping SSH proxy: {e}")
 
 
 class DesktopInstance(WithDB):
@@ -60,6 +278,7 @@ class DesktopInstance(WithDB):
         namespace: Optional[str] = None,
         ttl: Optional[int] = None,
         assigned: Optional[float] = None,
+        save: bool = True,
     ) -> None:
         if not id:
             id = shortuuid.uuid()
@@ -90,7 +309,24 @@ class DesktopInstance(WithDB):
         self.namespace = namespace
         self.ttl = ttl
 
-        self.save()
+        if save:
+            self.save()
+
+    @functools.cached_property
+    def provider(self) -> Optional[V1ProviderData]:
+        """Provider data, decoded from the stored record on first access"""
+        raw = getattr(self, "_provider_raw", None)
+        if not raw:
+            return None
+        return _parse_provider(raw).model_copy(deep=True)
+
+    @functools.cached_property
+    def metadata(self) -> Optional[dict]:
+        """Metadata, decoded from the stored record on first access"""
+        raw = getattr(self, "_metadata_raw", None)
+        if not raw:
+            return {}
+        return _loads(raw)
 
     @classmethod
     def get_encryption_key(cls) -> bytes:
@@ -141,53 +377,50 @@ class DesktopInstance(WithDB):
         decrypted_password = fernet.decrypt(base64.b64decode(encrypted_password))
         return decrypted_password.decode()
 
-    def to_record(self) -> V1DesktopRecord:
+    def to_record_dict(self) -> Dict[str, Any]:
+        # Fields which were never decoded can't have changed, store them as is
         provider = None
-        if self.provider:
-            provider = json.dumps(self.provider.__dict__)
+        if "provider" not in self.__dict__:
+            provider = getattr(self, "_provider_raw", None)
+        elif self.provider:
+            provider = self.provider.model_dump_json()
 
         metadata = None
-        if self.metadata:
-            metadata = json.dumps(self.metadata)
+        if "metadata" not in self.__dict__:
+            metadata = getattr(self, "_metadata_raw", None)
+        elif self.metadata:
+            metadata = _dumps(self.metadata)
 
         basic_auth_password = None
         if self.basic_auth_password:
             basic_auth_password = self.encrypt_password(self.basic_auth_password)
 
-        return V1DesktopRecord(
-            id=self.id,
-            name=self.name,
-            addr=self.addr,
-            cpu=self.cpu,
-            created=self.created,
-            assigned=self.assigned,
-            memory=self.memory,
-            disk=self.disk,
-            pid=self.pid,
-            status=self.status,
-            image=self.image,
-            provider=provider,
-            reserved_ip=self.reserved_ip,
-            requires_proxy=self.requires_proxy,
-            ssh_port=self.ssh_port,
-            meta=metadata,
-            owner_id=self.owner_id,
-            key_pair_name=self.key_pair_name,
-            agentd_port=self.agentd_port,
-            vnc_port=self.vnc_port,
-            vnc_port_https=self.vnc_port_https,
-            basic_auth_user=self.basic_auth_user,
-            basic_auth_password=basic_auth_password,
-            resource_name=self.resource_name,
-            namespace=self.namespace,
-            ttl=self.ttl,
-        )
+        record = {f: getattr(self, f) for f in _RECORD_FIELDS}
+        record["provider"] = provider
+        record["meta"] = metadata
+        record["basic_auth_password"] = basic_auth_password
+        return record
+
+    def to_record(self) -> V1DesktopRecord:
+        return V1DesktopRecord(**self.to_record_dict())
 
     def save(self) -> None:
-        for db in self.get_db():
+        self.save_many([self])
+
+    @classmethod
+    def save_many(cls, desktops: List[DesktopInstance]) -> None:
+        """Save many desktops in a single statement and transaction
+
+        Args:
+            desktops (List[DesktopInstance]): Desktops to save
+        """
+        if not desktops:
+            return
+
+        with cls._session() as db:
             try:
-                record = self.to_record()
-                db.merge(record)
+                stmt = _upsert_stmt(db.get_bind().dialect.name)
+                db.execute(stmt, [desktop.to_record_dict() for desktop in desktops])
                 db.commit()
             except Exception as e:
                 db.rollback()
@@ -197,83 +430,81 @@ class DesktopInstance(WithDB):
     @classmethod
     def from_record(cls, record: V1DesktopRecord) -> DesktopInstance:
         out = cls.__new__(DesktopInstance)  # type: ignore
-        out.id = record.id
-        out.name = record.name
-        out.addr = record.addr
-        out.cpu = record.cpu
-        out.created = record.created
-        out.assigned = record.assigned
-        out.memory = record.memory
-        out.disk = record.disk
-        out.pid = record.pid
-        out.status = record.status
-        out.image = record.image
-        out.reserved_ip = record.reserved_ip
-        out.requires_proxy = record.requires_proxy
-        out.ssh_port = record.ssh_port
-        out.owner_id = record.owner_id
-        out.key_pair_name = record.key_pair_name
-        out.agentd_port = record.agentd_port
-        out.vnc_port = record.vnc_port
-        out.vnc_port_https = record.vnc_port_https
-        out.resource_name = record.resource_name
-        out.namespace = record.namespace
-        out.ttl = record.ttl
-        if record.provider:  # type: ignore
-            dct = json.loads(str(record.provider))
-            out.provider = V1ProviderData(**dct)
-        out.metadata = {}
-        if record.meta:  # type: ignore
-            dct = json.loads(str(record.meta))
-            out.metadata = dct
+        # Set in one update, from_record runs for every row of a listing
+        out.__dict__.update((f, getattr(record, f)) for f in _RECORD_FIELDS)
+        out._provider_raw = record.provider
+        out._metadata_raw = record.meta
 
         out.basic_auth_password = None
         if record.basic_auth_password:  # type: ignore
             out.basic_auth_password = cls.decrypt_password(
                 str(record.basic_auth_password)
             )
-        out.basic_auth_user = record.basic_auth_user
         return out
 
     @classmethod
     def load(cls, id: str) -> DesktopInstance:
-        for db in cls.get_db():
-            record = db.query(V1DesktopRecord).filter(V1DesktopRecord.id == id).first()
+        with cls._session() as db:
+            record = db.execute(_SELECT_BY_ID, {"id": id}).scalar_one_or_none()
             if record is None:
                 raise ValueError(f"Desktop with id {id} not found")
             return cls.from_record(record)
-        raise ValueError("no session")
 
     @classmethod
     def get(
         cls, name: str, owner_id: Optional[str] = None
     ) -> Optional[DesktopInstance]:
-        for db in cls.get_db():
+        with cls._session() as db:
             record = (
-                db.query(V1DesktopRecord)
-                .filter_by(name=name, owner_id=owner_id)
+                db.execute(_SELECT_BY_NAME, {"name": name, "owner_id": owner_id})
+                .scalars()
                 .first()
             )
             if record is None:
                 return None
             return cls.from_record(record)
 
+    @classmethod
+    def _filters(cls, **kwargs) -> List[Any]:
+        clauses = []
+        for key, value in kwargs.items():
+            if key == "provider_type":
+                # The provider is stored as JSON with the type first, written
+                # compactly now and with spaces by older versions
+                clauses.append(
+                    or_(
+                        *(
+                            V1DesktopRecord.provider.like(pattern.format(value))
+                            for pattern in _PROVIDER_TYPE_PATTERNS
+                        )
+                    )
+                )
+                continue
+            column = getattr(V1DesktopRecord, key)
+            if isinstance(value, tuple) and len(value) == 2 and value[0] == "in":
+                clauses.append(column.in_(value[1]))
+            else:
+                clauses.append(column == value)
+        return clauses
+
     @classmethod
     def find(cls, **kwargs) -> List[DesktopInstance]:
         """Find desktops by given keyword arguments.
 
         For 'in' queries, pass a tuple with ('in', list_of_values) as the value.
         Example: find(owner_id=('in', ['user1', 'user2', 'user3']))
+
+        Pass `provider_type` to only load desktops of one provider type.
+        Example: find(provider_type='gce')
+
+        Prefer `find_v1` when the desktops are only read, it skips building
+        mutable instances.
         """
         out = []
-        for db in cls.get_db():
-            query = db.query(V1DesktopRecord)
-            for key, value in kwargs.items():
-                if isinstance(value, tuple) and len(value) == 2 and value[0] == "in":
-                    query = query.filter(getattr(V1DesktopRecord, key).in_(value[1]))
-                else:
-                    query = query.filter(getattr(V1DesktopRecord, key) == value)
-            records = query.all()
+        with cls._session() as db:
+            records = db.execute(
+                _SELECT_RECORDS.where(*cls._filters(**kwargs))
+            ).scalars()
             for record in records:
                 out.append(cls.from_record(record))
         return out
@@ -281,18 +512,30 @@ class DesktopInstance(WithDB):
     @classmethod
     def find_v1(cls, **kwargs) -> List[V1DesktopInstance]:
         """Find desktops by given keyword arguments."""
-        out = []
-        for db in cls.get_db():
-            query = db.query(V1DesktopRecord)
-            for key, value in kwargs.items():
-                if isinstance(value, tuple) and len(value) == 2 and value[0] == "in":
-                    query = query.filter(getattr(V1DesktopRecord, key).in_(value[1]))
-                else:
-                    query = query.filter(getattr(V1DesktopRecord, key) == value)
-            records = query.all()
-            for record in records:
-                out.append(cls.from_record(record).to_v1_schema())
-        return out
+        with cls._session() as db:
+            rows = db.execute(
+                select(*_V1_COLUMNS).where(*cls._filters(**kwargs))
+            ).mappings()
+            return [cls._v1_from_row(row) for row in rows]
+
+    @classmethod
+    def _v1_from_row(cls, row: Any) -> V1DesktopInstance:
+        fields = dict(row)
+
+        fields["provider"] = None
+        if row["provider"]:
+            fields["provider"] = _parse_provider(row["provider"]).model_copy(deep=True)
+
+        fields["meta"] = {}
+        if row["meta"]:
+            fields["meta"] = _loads(row["meta"])
+
+        if row["basic_auth_password"]:
+            fields["basic_auth_password"] = cls.decrypt_password(
+                row["basic_auth_password"]
+            )
+
+        return V1DesktopInstance(**fields)
 
     def delete(self, force: bool = False) -> None:
         try:
@@ -364,46 +607,54 @@ class DesktopInstance(WithDB):
             if not force:
                 raise e
 
-        for db in self.get_db():
+        with self._session() as db:
             try:
-                record = (
-                    db.query(V1DesktopRecord)
-                    .filter(V1DesktopRecord.id == self.id)
-                    .first()
-                )
-                if record is None:
-                    raise ValueError(f"Desktop with id {self.id} not found")
-
-                db.delete(record)
+                db.execute(_DELETE_BY_ID, {"id": self.id})
                 db.commit()
             except Exception as e:
                 pass
 
     @classmethod
     def name_exists(cls, name: str, owner_id: Optional[str] = None) -> bool:
-        for db in cls.get_db():
-            record = (
-                db.query(V1DesktopRecord)
-                .filter_by(name=name, owner_id=owner_id)
-                .first()
-            )
-            if record is None:
-                return False
+        with cls._session() as db:
+            params = {"name": name, "owner_id": owner_id}
+            return bool(db.execute(_EXISTS_BY_NAME, params).scalar())
 
-            return True
-
-        raise ValueError("no session")
+    @classmethod
+    def taken_names(cls, names: List[str]) -> List[str]:
+        """Which of the names are already used by a desktop, of any owner"""
+        if not names:
+            return []
+        with cls._session() as db:
+            return list(db.execute(_TAKEN_NAMES, {"names": names}).scalars())
 
     def remove(self) -> None:
-        for db in self.get_db():
-            record = (
-                db.query(V1DesktopRecord).filter(V1DesktopRecord.id == self.id).first()
-            )
-            if record is None:
+        with self._session() as db:
+            result = db.execute(_DELETE_BY_ID, {"id": self.id})
+            if result.rowcount == 0:
                 raise ValueError(f"Desktop with id {self.id} not found")
-            db.delete(record)
             db.commit()
 
+    @classmethod
+    def remove_many(cls, ids: List[str]) -> int:
+        """Remove many desktops from state in a single statement
+
+        Args:
+            ids (List[str]): IDs of the desktops to remove
+
+        Returns:
+            int: Number of desktops removed
+        """
+        if not ids:
+            return 0
+
+        with cls._session() as db:
+            result = db.execute(
+                sql_delete(V1DesktopRecord).where(V1DesktopRecord.id.in_(ids))
+            )
+            db.commit()
+            return result.rowcount
+
     def to_v1_schema(self) -> V1DesktopInstance:
         return V1DesktopInstance(
             id=self.id,
@@ -489,99 +740,90 @@ class DesktopInstance(WithDB):
             input("Press any key to exit...")
             return
 
-        if self.requires_proxy:
-            keys = SSHKeyPair.find(name=self.key_pair_name)
-            if not keys:
-                raise ValueError(
-                    f"No key pair found with name {self.key_pair_name} and is required for this desktop"
+        # Resources are owned by the stack so they are released in reverse
+        # order on exit, on Ctrl-C and if a later step raises
+        with contextlib.ExitStack() as stack:
+            if self.requires_proxy:
+                keys = SSHKeyPair.find(name=self.key_pair_name)
+                if not keys:
+                    raise ValueError(
+                        f"No key pair found with name {self.key_pair_name} and is required for this desktop"
+                    )
+                key_pair = keys[0]
+
+                if check_port_in_use(6080):
+                    raise ValueError(
+                        "Port 6080 is already in use, UI requires this port"
+                    )  # TODO: remove this restriction
+                proxy_pid = ensure_ssh_proxy(
+                    6080,
+                    6080,
+                    self.ssh_port,
+                    "agentsea",
+                    self.addr,  # type: ignore  # TODO: replace with proxy()
+                    key_pair.decrypted_private_key,
+                    bind_addr=bind_addr,
                 )
-            key_pair = keys[0]
-
-            if check_port_in_use(6080):
-                raise ValueError(
-                    "Port 6080 is already in use, UI requires this port"
-                )  # TODO: remove this restriction
-            proxy_pid = ensure_ssh_proxy(
-                6080,
-                6080,
-                self.ssh_port,
-                "agentsea",
-                self.addr,  # type: ignore  # TODO: replace with proxy()
-                key_pair.decrypt_private_key(key_pair.private_key),
-                bind_addr=bind_addr,
-            )
-            atexit.register(cleanup_proxy, proxy_pid)
-
-        check_command_availability("docker")
-
-        host = get_docker_host()
-        os.environ["DOCKER_HOST"] = host
-        client = docker.from_env()
-
-        host_port = None
-        ui_container: Optional[Container] = None
-
-        for container in client.containers.list():
-            if container.image.tags[0] == UI_IMG:  # type: ignore
-                print("found running UI container")
-                # Retrieve the host port for the existing container
-                host_port = container.attrs["NetworkSettings"]["Ports"]["3000/tcp"][0][  # type: ignore
-                    "HostPort"
-                ]
-                ui_container = container  # type: ignore
-                break
-
-        if not ui_container:
-            print("creating UI container...")
-            host_port = random.randint(1024, 65535)
-            ui_container = client.containers.run(  # type: ignore
-                UI_IMG, ports={"3000/tcp": host_port}, detach=True
+                stack.callback(_stop_proxy, proxy_pid)
+
+            host_port, ui_container = _ensure_ui_container()
+
+            if browser:
+                webbrowser.open(f"http://localhost:{host_port}")
+            else:
+                print(f"\n>>> UI available at http://localhost:{host_port}\n")
+
+            if background:
+                # The proxy outlives this call, the UI container is left running
+                atexit.register(stack.pop_all().close)
+                return
+
+            stack.callback(_stop_ui_container, ui_container)
+            stack.callback(print, "Cleaning up resources...")
+
+            print(
+                f"proxying desktop vnc '{self.name}' to {bind_addr}:6080... (Ctrl-C to exit)"
             )
-            print("waiting for UI container to start...")
-            time.sleep(10)
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                print("Keyboard interrupt received, exiting...")
 
-        if browser:
-            webbrowser.open(f"http://localhost:{host_port}")
-        else:
-            print(f"\n>>> UI available at http://localhost:{host_port}\n")
 
-        if background:
-            return
+@dataclass
+class WaitForReadyOptions:
+    """How a provider polls a new desktop until its agentd is healthy"""
 
-        def onexit():
-            nonlocal proxy_pid
-            print("Cleaning up resources...")
+    initial_delay: float = 0.2
+    max_delay: float = 5.0
+    multiplier: float = 1.5
+    timeout: float = 600.0
+    # Full jitter, each delay is drawn from [0, delay] so desktops created
+    # together don't poll in lockstep
+    jitter: bool = True
 
-            # Check if the UI container still exists and stop/remove it if so
-            if ui_container:
-                try:
-                    container_status = client.containers.get(ui_container.id).status  # type: ignore
-                    if container_status in ["running", "paused"]:
-                        print("stopping UI container...")
-                        ui_container.stop()
-                        print("removing UI container...")
-                        ui_container.remove()
-                except docker.errors.NotFound:  # type: ignore
-                    print("UI container already stopped/removed.")
-
-            # Stop the SSH proxy if required and not already stopped
-            if self.requires_proxy and proxy_pid:
-                try:
-                    print("stopping ssh proxy...")
-                    cleanup_proxy(proxy_pid)
-                except Exception as e:
-                    print(f"Error stopping SSH proxy: {e}")
-                finally:
-                    proxy_pid = None  # Ensure we don't try to stop it again
+    def delays(self) -> Iterator[float]:
+        """Yield the delay before each poll, the first poll is immediate"""
+        yield 0.0
+        delay = self.initial_delay
+        while True:
+            yield random.uniform(0, delay) if self.jitter else delay
+            delay = min(delay * self.multiplier, self.max_delay)
+
+
+# Seconds between health polls once the tunnel is up but agentd isn't
+_QUICK_RETRY_DELAY = 0.5
+# Most seconds added to the quick retry and to Retry-After waits, which have
+# no backoff to jitter, so parallel waits still drift apart
+_RETRY_JITTER = 0.25
 
-        atexit.register(onexit)
-        try:
-            while True:
-                print(f"proxying desktop vnc '{self.name}' to {bind_addr}:6080...")
-                time.sleep(20)
-        except KeyboardInterrupt:
-            print("Keyboard interrupt received, exiting...")
-            onexit()
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    """Seconds a response asks to wait via Retry-After, if given in seconds"""
+    try:
+        return max(0.0, float(response.headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return None
 
 
 DP = TypeVar("DP", bound="DesktopProvider")
@@ -590,6 +832,9 @@ DP = TypeVar("DP", bound="DesktopProvider")
 class DesktopProvider(ABC, Generic[DP]):
     """A provider of desktop virtual machines"""
 
+    # How new desktops are polled until agentd is healthy
+    WAIT_FOR_READY = WaitForReadyOptions()
+
     @abstractmethod
     def create(
         self,
@@ -633,6 +878,56 @@ class DesktopProvider(ABC, Generic[DP]):
         """
         pass
 
+    def create_many(
+        self, specs: List[Dict[str, Any]], max_workers: int = 8
+    ) -> List[DesktopInstance]:
+        """Create several desktops concurrently.
+
+        Args:
+            specs (List[Dict[str, Any]]): Keyword arguments for `create`, one per desktop.
+            max_workers (int, optional): Max desktops being created at once. Defaults to 8.
+
+        Returns:
+            List[DesktopInstance]: The desktops, in the order of `specs`.
+        """
+        names = [spec["name"] for spec in specs if spec.get("name")]
+        if len(names) != len(set(names)):
+            raise ValueError("desktop names must be unique")
+        # One lookup for the whole batch, before anything is launched. Names
+        # are unique across owners, so any owner's desktop blocks one
+        taken = DesktopInstance.taken_names(names)
+        if taken:
+            raise ValueError(f"VM names already exist: {', '.join(taken)}")
+
+        creates = self._batch_creates(len(specs))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(create, **spec) for create, spec in zip(creates, specs)
+            ]
+            desktops = []
+            errors = []
+            for future in futures:
+                try:
+                    desktops.append(future.result())
+                except Exception as e:
+                    errors.append(e)
+
+        # Record whatever was launched, even if some creates failed
+        DesktopInstance.save_many(desktops)
+        if errors:
+            raise errors[0]
+        return desktops
+
+    def _batch_creates(self, count: int) -> List[Callable[..., DesktopInstance]]:
+        """`create` callables for `create_many`, one per desktop.
+
+        They run on separate threads and must not save their desktops, the
+        batch is saved together once every create is done.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support creating desktops concurrently"
+        )
+
     @abstractmethod
     def delete(self, name: str, owner_id: Optional[str] = None) -> None:
         """Delete a VM
@@ -712,3 +1007,119 @@ class DesktopProvider(ABC, Generic[DP]):
     def refresh(self, log: bool = True) -> None:
         """Refresh state"""
         pass
+
+    def _wait_till_ready(
+        self,
+        ssh_host: str,
+        ssh_port: int = 22,
+        private_ssh_key: Optional[str] = None,
+        options: Optional[WaitForReadyOptions] = None,
+    ) -> None:
+        """Wait for the agentd of a desktop to be healthy.
+
+        agentd is polled through an ssh tunnel to the desktop. The tunnel is
+        built once and only rebuilt if ssh exits, e.g. while sshd is still
+        starting, one keep-alive connection to agentd serves every poll.
+
+        Args:
+            ssh_host (str): Host of the desktop.
+            ssh_port (int, optional): SSH port of the desktop. Defaults to 22.
+            private_ssh_key (str, optional): SSH key to use. Defaults to None.
+            options (WaitForReadyOptions, optional): How to poll. Defaults to `WAIT_FOR_READY`.
+
+        Raises:
+            TimeoutError: If agentd isn't healthy within `options.timeout`.
+        """
+        options = options or self.WAIT_FOR_READY
+        print("waiting for desktop to be ready...")
+        # The OS hands out distinct ports, so concurrent waits don't collide
+        local_agentd_port = get_free_port()
+
+        delays = options.delays()
+        deadline = time.monotonic() + options.timeout
+
+        def remaining() -> float:
+            """Seconds left to wait, raises once there are none"""
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise TimeoutError(
+                    f"agentd at {ssh_host}:{ssh_port} did not become "
+                    f"healthy within {options.timeout}s"
+                )
+            return left
+
+        quick_retry = False
+        retry_after: Optional[float] = None
+        pid: Optional[int] = None
+        stop_proxy = None
+        # A refused connect, slow read or 503 fails the poll at once, the loop
+        # owns retrying and its backoff, so no wait outlasts the deadline
+        with retrying_session(connect=0, read=0, status=0) as session:
+            try:
+                # Every wait below is bounded by the time remaining, so the
+                # loop gives up at the deadline rather than an iteration later
+                while True:
+                    if retry_after is None and not quick_retry:
+                        delay = next(delays)
+                    else:
+                        delay = _QUICK_RETRY_DELAY if quick_retry else retry_after
+                        if options.jitter:
+                            delay += random.uniform(0, _RETRY_JITTER)
+                    time.sleep(min(delay, remaining()))
+                    quick_retry = False
+                    retry_after = None
+
+                    if pid is None or not proxy_alive(pid):
+                        # A refused connect is much cheaper than a failed ssh
+                        # handshake while the desktop is still booting
+                        if not tcp_port_open(
+                            ssh_host, ssh_port, timeout=min(2.0, remaining())
+                        ):
+                            logger.debug("ssh port not open yet")
+                            continue
+                        # Starting ssh takes a couple of seconds
+                        remaining()
+                        try:
+                            logger.debug("ensuring up ssh proxy...")
+                            pid = ensure_ssh_proxy(
+                                local_port=local_agentd_port,
+                                remote_port=8000,
+                                ssh_port=ssh_port,
+                                ssh_host=ssh_host,
+                                ssh_key=private_ssh_key,
+                                log_error=False,
+                            )
+                        except Exception as e:
+                            logger.debug("ssh proxy not up yet: %s", e)
+                            continue
+                        # Only this tunnel's exit handler is swapped, other
+                        # tunnels in the process keep theirs
+                        if stop_proxy:
+                            atexit.unregister(stop_proxy)
+                        stop_proxy = functools.partial(cleanup_proxy, pid, False)
+                        atexit.register(stop_proxy)
+
+                    try:
+                        logger.debug("calling agentd...")
+                        left = remaining()
+                        response = session.get(
+                            f"http://localhost:{local_agentd_port}/health",
+                            timeout=(min(1.0, left), min(2.0, left)),
+                        )
+                        logger.debug("agentd response: %s", response)
+                        if response.status_code == 200:
+                            return
+                        retry_after = _retry_after(response)
+                    except requests.Timeout as e:
+                        logger.debug("agentd timed out: %s", e)
+                    except requests.ConnectionError as e:
+                        # The tunnel is up but agentd isn't listening yet, it
+                        # usually is shortly so retry without backing off
+                        logger.debug("agentd not listening yet: %s", e)
+                        quick_retry = True
+                    except requests.RequestException as e:
+                        logger.debug("agentd not ready yet: %s", e)
+            finally:
+                if stop_proxy:
+                    atexit.unregister(stop_proxy)
+                    stop_proxy()
@@ -265,7 +265,7 @@ class DockerProvider(DesktopProvider):
         Returns:
             List[VM]: A list of VMs
         """
-        instances = DesktopInstance.find()
+        instances = DesktopInstance.find(provider_type="docker")
 
         out = []
 
@@ -1,26 +1,152 @@
 from __future__ import annotations
-from typing import List, Optional, Dict, Any
-import atexit
+from typing import TYPE_CHECKING, Callable, List, Optional, Dict, Any, Set, Tuple
+import copy
+import functools
+import re
+import threading
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
-from mypy_boto3_ec2.service_resource import Instance as EC2Instance
-from mypy_boto3_ec2 import EC2Client, EC2ServiceResource
 from namesgenerator import get_random_name
+from botocore.config import Config
 from botocore.exceptions import ClientError
-import requests
 
 from .base import DesktopInstance, DesktopProvider
-from .img import JAMMY
+from .img import IMAGE_REGISTRY, JAMMY
 from agentdesk.server.models import V1ProviderData
-from agentdesk.util import find_open_port, generate_short_hash, generate_random_string
-from agentdesk.proxy import ensure_ssh_proxy, cleanup_proxy
+from agentdesk.util import generate_short_hash, generate_random_string
 from agentdesk.key import SSHKeyPair
 
+if TYPE_CHECKING:
+    from mypy_boto3_ec2.service_resource import Instance as EC2Instance
+    from mypy_boto3_ec2 import EC2Client, EC2ServiceResource
+
 
 logger = logging.getLogger(__name__)
 
+# Disk sizes like "30gb", "30 GiB" or "1tb"
+_DISK_SIZE_RE = re.compile(r"^\s*(\d+)\s*(gb|gib|tb|tib)\s*$", re.IGNORECASE)
+# Units in GiB, gb is taken as GiB for simplicity
+_DISK_UNIT_GIB = {"gb": 1, "gib": 1, "tb": 1024, "tib": 1024}
+
+# Adaptive retries back off with jitter and rate limit the client when EC2
+# throttles, bounded timeouts keep a stalled call from hanging a create
+_BOTO_CONFIG = Config(
+    retries={"max_attempts": 10, "mode": "adaptive"},
+    connect_timeout=5,
+    read_timeout=15,
+)
+
+# Instance state changes usually settle in seconds, poll every 3s rather than
+# the default 15s while keeping the default 10 minute ceiling
+_WAITER_CONFIG = {"Delay": 3, "MaxAttempts": 200}
+
+# Describe* results which rarely change, key -> (expiry, value). Keys are
+# scoped by region and credentials as resources are per account
+_cache: Dict[Tuple, Tuple[float, Any]] = {}
+
+_RESOURCE_TTL = 15 * 60
+# Image names are published once per release, so their ids live longer
+_AMI_TTL = 6 * 60 * 60
+
+
+def _cache_get(key: Tuple, ttl: float, fn: Callable[[], Any]) -> Any:
+    now = time.monotonic()
+    hit = _cache.get(key)
+    if hit and hit[0] > now:
+        return hit[1]
+    value = fn()
+    _cache[key] = (now + ttl, value)
+    return value
+
+
+def clear_cache() -> None:
+    """Drop cached EC2 lookups, e.g. after changing resources outside agentdesk"""
+    _cache.clear()
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling EC2 while a region's circuit is open"""
+
+
+class CircuitBreaker:
+    """Fails EC2 calls fast once a region keeps failing server side.
+
+    Closed, calls go through. After `failure_threshold` consecutive failures
+    it opens and calls raise CircuitOpen. Once `recovery_timeout` has passed
+    one trial call is let through, it closes the circuit again on success.
+    """
+
+    # Error codes which mean EC2 is shedding load rather than rejecting a request
+    THROTTLE_CODES = {"RequestLimitExceeded", "Throttling", "ThrottlingException"}
+
+    def __init__(
+        self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def register(self, client: Any) -> None:
+        """Guard every call made by a boto3 client"""
+        events = client.meta.events
+        events.register("before-call.ec2", self._before_call, unique_id="cb-before")
+        events.register("after-call.ec2", self._after_call, unique_id="cb-after")
+        events.register(
+            "after-call-error.ec2", self._after_call_error, unique_id="cb-error"
+        )
+
+    def _before_call(self, **kwargs) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.recovery_timeout:
+                raise CircuitOpen(f"EC2 circuit for {self.name} is open")
+            # Half open, re-arm so other callers keep failing fast during the trial
+            self._opened_at = time.monotonic()
+
+    def _after_call(self, http_response: Any, parsed: Dict[str, Any], **kwargs) -> None:
+        code = parsed.get("Error", {}).get("Code")
+        if http_response.status_code >= 500 or code in self.THROTTLE_CODES:
+            self._record(failed=True)
+        else:
+            self._record(failed=False)
+
+    def _after_call_error(self, **kwargs) -> None:
+        # Connection errors and timeouts which outlasted the retries
+        self._record(failed=True)
+
+    def _record(self, failed: bool) -> None:
+        with self._lock:
+            if not failed:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"opening EC2 circuit for {self.name}")
+                self._opened_at = time.monotonic()
+
+
+# One breaker per region, shared by all providers in the process
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+
+
+def _bulkheaded(method: Callable) -> Callable:
+    """Run a provider method inside the provider's bulkhead"""
+
+    @functools.wraps(method)
+    def wrapper(self: EC2Provider, *args, **kwargs):
+        with self._bulkhead:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
 
 class EC2Provider(DesktopProvider):
     """VM provider using AWS EC2"""
@@ -35,13 +161,29 @@ class EC2Provider(DesktopProvider):
         "ap-northeast-1",
     }
 
+    # Instance types as (vcpus, memory GiB, type), smallest first. The first
+    # which fits the requested cpu and memory is used. Override to change family
+    INSTANCE_TYPES: List[Tuple[int, int, str]] = [
+        (2, 4, "t3.medium"),
+        (2, 8, "t3.large"),
+        (4, 16, "t3.xlarge"),
+        (8, 32, "t3.2xlarge"),
+    ]
+
     def __init__(
         self,
         region: str,
         aws_access_key_id: Optional[str] = None,
         aws_secret_access_key: Optional[str] = None,
+        max_concurrent: int = 8,
     ):
-        """Initialize the AWS EC2 VM Provider with region and optional credentials."""
+        """Initialize the AWS EC2 VM Provider with region and optional credentials.
+
+        At most `max_concurrent` creates, starts and deletes run at once, each
+        holds API calls, an ssh tunnel and a health session while in flight.
+        """
+        import boto3
+
         self.region = region
         if aws_access_key_id and aws_secret_access_key:
             self.session = boto3.Session(
@@ -53,10 +195,24 @@ class EC2Provider(DesktopProvider):
             self.session = boto3.Session(region_name=self.region)
 
         self.ec2: EC2ServiceResource = self.session.resource(
-            "ec2", region_name=self.region
+            "ec2", region_name=self.region, config=_BOTO_CONFIG
         )  # type: ignore
-        self.ec2_client: EC2Client = self.session.client("ec2", region_name=self.region)  # type: ignore
+        self.ec2_client: EC2Client = self.session.client("ec2", region_name=self.region, config=_BOTO_CONFIG)  # type: ignore
+        self._breaker = _BREAKERS.setdefault(self.region, CircuitBreaker(self.region))
+        self._breaker.register(self.ec2_client)
+        self._breaker.register(self.ec2.meta.client)
+        credentials = self.session.get_credentials()
+        self._cache_scope = (
+            self.region,
+            credentials.access_key if credentials else None,
+        )
+        self._save_desktops = True
+        # Instance ids by desktop name, filled by create and listings
+        self._name_to_id: Dict[str, str] = {}
+        # Shared with the copies made by create_many
+        self._bulkhead = threading.Semaphore(max_concurrent)
 
+    @_bulkheaded
     def create(
         self,
         name: Optional[str] = None,
@@ -94,8 +250,9 @@ class EC2Provider(DesktopProvider):
         if DesktopInstance.name_exists(name):
             raise ValueError(f"VM name '{name}' already exists")
 
-        if not image:
-            image = self._get_ami_id_by_name(JAMMY.ec2)  # type: ignore
+        registered = IMAGE_REGISTRY.get(image or JAMMY.name)
+        if registered:
+            image = self._get_ami_id_by_name(registered.ec2)  # type: ignore
 
         if not ssh_key_pair:
             key_pair = SSHKeyPair.generate_key(
@@ -103,8 +260,6 @@ class EC2Provider(DesktopProvider):
                 owner_id or "local",
                 metadata={"generated_for": name},
             )
-            public_ssh_key = key_pair.public_key
-            private_ssh_key = key_pair.decrypt_private_key(key_pair.private_key)
         else:
             key_pairs = SSHKeyPair.find(name=ssh_key_pair, owner_id=owner_id or "local")
             if not key_pairs:
@@ -112,7 +267,7 @@ class EC2Provider(DesktopProvider):
             key_pair = key_pairs[0]
 
         public_ssh_key = key_pair.public_key
-        private_ssh_key = key_pair.decrypt_private_key(key_pair.private_key)
+        private_ssh_key = key_pair.decrypted_private_key
 
         user_data = f"""#cloud-config
 users:
@@ -125,25 +280,24 @@ users:
 """
         instance_type = self._choose_instance_type(cpu, memory)
 
-        ssh_key_name = self._ensure_ssh_key(name, public_ssh_key)
+        # Both are independent round trips to EC2, overlap them
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            key_future = executor.submit(self._ensure_ssh_key, name, public_ssh_key)
+            sg_future = executor.submit(
+                self._ensure_sg, "agentdesk-default", "agentdesk default vm sg"
+            )
+            ssh_key_name = key_future.result()
+            security_group_id = sg_future.result()
         if not ssh_key_name:
             raise ValueError("SSH key name not provided or found")
 
         disk_size_gib = self._convert_disk_size_to_gib(disk)
-        security_group_id = self._ensure_sg(
-            "agentdesk-default", "agentdesk default vm sg"
-        )
 
+        # The volume gets the same tags so it shows up under the desktop in
+        # cost allocation
         tag_specifications = [
-            {
-                "ResourceType": "instance",
-                "Tags": [
-                    {"Key": "Name", "Value": name},
-                    {"Key": "Owner", "Value": owner_id or "local"},
-                    {"Key": "provisioner", "Value": "agentdesk"},
-                ]
-                + [{"Key": k, "Value": v} for k, v in (tags or {}).items()],
-            }
+            self._tag_spec("instance", name, owner_id, tags),
+            self._tag_spec("volume", name, owner_id, tags),
         ]
 
         instances = self.ec2.create_instances(
@@ -163,13 +317,16 @@ users:
             UserData=user_data,
         )
         instance_id = instances[0].id
-        instances[0].wait_until_running()
+        self._name_to_id[name] = instance_id
+        self._wait_for("running", instance_id)
 
         if reserve_ip:
-            eip = boto3.client("ec2", region_name=self.region).allocate_address(
-                Domain="vpc"
+            # Tagged with the desktop name so delete can find it directly
+            eip = self.ec2_client.allocate_address(
+                Domain="vpc",
+                TagSpecifications=[self._tag_spec("elastic-ip", name, owner_id)],
             )
-            boto3.client("ec2", region_name=self.region).associate_address(
+            self.ec2_client.associate_address(
                 InstanceId=instance_id, AllocationId=eip["AllocationId"]
             )
 
@@ -192,67 +349,72 @@ users:
             owner_id=owner_id,
             metadata=metadata,
             key_pair_name=key_pair.name,
+            reserved_ip=reserve_ip,
             ttl=ttl,
+            save=self._save_desktops,
         )
 
         print(f"\nsuccessfully created desktop '{name}'")
         return desktop
 
-    def _wait_till_ready(
+    def _batch_creates(self, count: int) -> List[Callable[..., DesktopInstance]]:
+        # Shared lookups are done once up front so workers don't race on them
+        self._ensure_sg("agentdesk-default", "agentdesk default vm sg")
+        self._key_names()
+
+        # boto3 resources are not thread safe, each worker gets its own. They
+        # are built here as the session isn't thread safe either
+        creates = []
+        for _ in range(count):
+            worker = copy.copy(self)
+            worker.ec2 = self.session.resource("ec2", region_name=self.region, config=_BOTO_CONFIG)  # type: ignore
+            self._breaker.register(worker.ec2.meta.client)
+            worker._save_desktops = False
+            creates.append(worker.create)
+        return creates
+
+    def _tag_spec(
         self,
-        addr: str,
-        local_agentd_port: Optional[int] = None,
-        private_ssh_key: Optional[str] = None,
-    ) -> None:
-        if not local_agentd_port:
-            local_agentd_port = find_open_port(8000, 9000)
-            if not local_agentd_port:
-                raise ValueError("could not find open port")
-        print("waiting for desktop to be ready...")
-
-        ready = False
-        while not ready:
-            print("waiting for desktop to be ready...")
-            time.sleep(3)
-            try:
-                logger.debug("ensuring up ssh proxy...")
-                pid = ensure_ssh_proxy(
-                    local_port=local_agentd_port,
-                    remote_port=8000,
-                    ssh_host=addr,
-                    ssh_key=private_ssh_key,
-                    log_error=False,
-                )
-                atexit.register(cleanup_proxy, pid)
-
-                logger.debug("calling agentd...")
-                response = requests.get(f"http://localhost:{local_agentd_port}/health")
-                logger.debug(f"agentd response: {response}")
-                if response.status_code == 200:
-                    ready = True
-                cleanup_proxy(pid)
-                atexit.unregister(cleanup_proxy)
-            except Exception:
-                try:
-                    cleanup_proxy(pid, log_error=False)  # type: ignore
-                except Exception:
-                    pass
-
-        logger.debug("cleaning up tunnel")
-        try:
-            cleanup_proxy(pid)  # type: ignore
-            atexit.unregister(cleanup_proxy)
-        except Exception:
-            pass
+        resource_type: str,
+        name: str,
+        owner_id: Optional[str] = None,
+        tags: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, Any]:
+        """Tag specification for a resource created for a desktop"""
+        base = (
+            {"Key": "Name", "Value": name},
+            {"Key": "Owner", "Value": owner_id or "local"},
+            {"Key": "provisioner", "Value": "agentdesk"},
+        )
+        extra = tuple({"Key": k, "Value": v} for k, v in (tags or {}).items())
+        return {"ResourceType": resource_type, "Tags": base + extra}
+
+    def _wait_for(self, state: str, instance_id: str) -> None:
+        """Wait for an instance to reach a state, e.g. 'running' or 'stopped'"""
+        waiter = self.ec2_client.get_waiter(f"instance_{state}")  # type: ignore
+        waiter.wait(InstanceIds=[instance_id], WaiterConfig=_WAITER_CONFIG)
 
     def _ensure_sg(self, name: str, description: str) -> str:
-        # Attempt to find the default VPC
-        vpcs = self.ec2_client.describe_vpcs(
-            Filters=[{"Name": "isDefault", "Values": ["true"]}]
+        return _cache_get(
+            ("sg", name) + self._cache_scope,
+            _RESOURCE_TTL,
+            lambda: self._find_or_create_sg(name, description),
         )
-        if not vpcs["Vpcs"]:
-            raise Exception("No default VPC found in this region.")
-        default_vpc_id = vpcs["Vpcs"][0]["VpcId"]  # type: ignore
+
+    def _default_vpc_id(self) -> str:
+        def fetch() -> str:
+            vpcs = self.ec2_client.describe_vpcs(
+                Filters=[{"Name": "isDefault", "Values": ["true"]}]
+            )
+            if not vpcs["Vpcs"]:
+                raise Exception("No default VPC found in this region.")
+            return vpcs["Vpcs"][0]["VpcId"]  # type: ignore
+
+        return _cache_get(("vpc",) + self._cache_scope, _RESOURCE_TTL, fetch)
+
+    def _find_or_create_sg(self, name: str, description: str) -> str:
+        # Attempt to find the default VPC
+        default_vpc_id = self._default_vpc_id()
 
         # Check if the security group already exists
         try:
@@ -299,53 +461,53 @@ users:
         :param disk_size: Disk size string with units.
         :return: Disk size in GiB as an integer.
         """
-        unit = disk_size[-2:].lower()
-        size = int(disk_size[:-2])
-        if unit == "gb":
-            return size  # Assuming input in GiB, direct conversion for simplicity
-        elif unit == "tb":
-            return size * 1024  # Convert TB to GiB
-        else:
-            raise ValueError(f"Unsupported disk size unit: {unit}")
+        match = _DISK_SIZE_RE.match(disk_size)
+        if not match:
+            raise ValueError(
+                f"Unsupported disk size: {disk_size!r}, expected e.g. '30gb' or '1tb'"
+            )
+        size, unit = match.groups()
+        return int(size) * _DISK_UNIT_GIB[unit.lower()]
 
     def _choose_instance_type(self, cpu: int, memory: int) -> str:
         """
         Choose an EC2 instance type based on CPU and memory requirements.
         """
-        # This is a simple mapping. Update it according to your needs.
-        if cpu <= 2:
-            if memory <= 4:
-                return "t2.medium"
-            elif memory <= 8:
-                return "t2.large"
-            else:
-                return "t2.medium"
-        elif cpu <= 4:
-            if memory <= 16:
-                return "t2.xlarge"
-            else:
-                return "t2.2xlarge"
-        else:
-            # Default to a larger instance for higher requirements
-            return "t2.2xlarge"
+        for max_cpu, max_memory, instance_type in self.INSTANCE_TYPES:
+            if cpu <= max_cpu and memory <= max_memory:
+                return instance_type
+        # Default to the largest instance for higher requirements
+        return self.INSTANCE_TYPES[-1][2]
 
     def _ensure_ssh_key(self, key_name: str, public_key_material: str) -> str:
         """
         Uploads an SSH public key to AWS EC2, if it does not already exist.
         """
-        ec2_client = boto3.client("ec2", region_name=self.region)
-        try:
-            ec2_client.describe_key_pairs(KeyNames=[key_name])
+        known_keys = self._key_names()
+        if key_name in known_keys:
             print(f"Key pair '{key_name}' already exists. Skipping import.")
             return key_name
-        except ec2_client.exceptions.ClientError as e:
-            if "InvalidKeyPair.NotFound" in str(e):
-                ec2_client.import_key_pair(
-                    KeyName=key_name, PublicKeyMaterial=public_key_material
-                )
-                print(f"Key pair '{key_name}' successfully imported.")
-                return key_name
-            raise
+
+        try:
+            self.ec2_client.import_key_pair(
+                KeyName=key_name, PublicKeyMaterial=public_key_material
+            )
+            print(f"Key pair '{key_name}' successfully imported.")
+        except self.ec2_client.exceptions.ClientError as e:
+            # imported elsewhere since the key pairs were listed
+            if "InvalidKeyPair.Duplicate" not in str(e):
+                raise
+        known_keys.add(key_name)
+        return key_name
+
+    def _key_names(self) -> Set[str]:
+        """Names of the key pairs in the region, the cached set is kept up to date"""
+
+        def fetch() -> Set[str]:
+            key_pairs = self.ec2_client.describe_key_pairs().get("KeyPairs", [])
+            return {kp["KeyName"] for kp in key_pairs}  # type: ignore
+
+        return _cache_get(("keypairs",) + self._cache_scope, _RESOURCE_TTL, fetch)
 
     def _get_ami_id_by_name(self, ami_name: str) -> str:
         """
@@ -354,43 +516,64 @@ users:
         Returns:
             The AMI ID of the latest custom AMI if found, otherwise None.
         """
-        images = self.ec2_client.describe_images(
-            Filters=[{"Name": "name", "Values": [ami_name]}]
-        ).get("Images", [])
-        if not images:
-            raise ValueError(
-                f"No images found with name: {ami_name} in region {self.region}"
-            )
-        return images[0]["ImageId"]  # type: ignore
 
-    def _release_eip(self, instance: EC2Instance) -> None:
-        # Assuming you have tagged your EIPs or have a way to associate them with instances
-        filters = [{"Name": "instance-id", "Values": [instance.id]}]
-        addresses = self.ec2_client.describe_addresses(Filters=filters)  # type: ignore
-        for address in addresses.get("Addresses", []):
-            self.ec2_client.release_address(AllocationId=address["AllocationId"])  # type: ignore
-            print(f"Released EIP: {address['PublicIp']}")  # type: ignore
+        def fetch() -> str:
+            images = self.ec2_client.describe_images(
+                Filters=[{"Name": "name", "Values": [ami_name]}]
+            ).get("Images", [])
+            if not images:
+                raise ValueError(
+                    f"No images found with name: {ami_name} in region {self.region}"
+                )
+            # Copies of an image can share its name, take the newest in one pass
+            newest = max(images, key=lambda image: image.get("CreationDate", ""))
+            return newest["ImageId"]  # type: ignore
+
+        return _cache_get(("ami", ami_name) + self._cache_scope, _AMI_TTL, fetch)
+
+    def _release_eip(self, name: str) -> None:
+        """Release the elastic IP reserved for a desktop, if any"""
+        filters = [
+            {"Name": "tag:Name", "Values": [name]},
+            {"Name": "tag:provisioner", "Values": ["agentdesk"]},
+        ]
+        try:
+            addresses = self.ec2_client.describe_addresses(Filters=filters)  # type: ignore
+            for address in addresses.get("Addresses") or []:
+                self.ec2_client.release_address(AllocationId=address["AllocationId"])  # type: ignore
+                print(f"Released EIP: {address.get('PublicIp')}")
+        except ClientError as e:
+            print(f"Failed to release EIP for {name}: {e}")
 
     def _delete_ssh_key(self, name: str) -> None:
         try:
             self.ec2_client.delete_key_pair(KeyName=name)
+            cached = _cache.get(("keypairs",) + self._cache_scope)
+            if cached:
+                cached[1].discard(name)
             print(f"Deleted SSH key: {name}")
         except self.ec2_client.exceptions.ClientError as e:
             print(f"Failed to delete SSH key {name}: {e}")
 
+    @_bulkheaded
     def delete(self, name: str, owner_id: Optional[str] = None) -> None:
         instance = self._get_instance_by_name(name, owner_id=owner_id)
+        self._name_to_id.pop(name, None)
         if instance:
-            # Release EIP if reserved for the instance
-            # self._release_eip(instance) # TODO
-
             # Terminate the instance
             instance.terminate()
-            instance.wait_until_terminated()
-            print("Remote instance terminated")
 
+            # The key pair is independent of the instance, so delete it while
+            # termination is in progress; errors are handled in _delete_ssh_key
             # TODO: for now we always create the key
-            self._delete_ssh_key(name)
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                key_future = executor.submit(self._delete_ssh_key, name)
+                self._wait_for("terminated", instance.id)
+                print("Remote instance terminated")
+                key_future.result()
+
+            # Termination disassociates the EIP, which can only be released then
+            self._release_eip(name)
 
             # Remove the desktop VM from local state
             desk = DesktopInstance.get(name)
@@ -410,6 +593,7 @@ users:
                     key.delete(key.name, key.owner_id)
                     print(f"Deleted SSH key {key.name}")
 
+    @_bulkheaded
     def start(
         self,
         name: str,
@@ -422,7 +606,9 @@ users:
         instance = self._get_instance_by_name(name)
         if instance:
             instance.start()
-            instance.wait_until_running()
+            self._wait_for("running", instance.id)
+            # A started instance usually gets a new public address
+            instance.reload()
 
         if not instance:
             raise ValueError("Instance not found")
@@ -440,18 +626,18 @@ users:
         instance = self._get_instance_by_name(name)
         if instance:
             instance.stop()
-            instance.wait_until_stopped()
+            self._wait_for("stopped", instance.id)
         desk.status = "stopped"
         desk.save()
 
     def list_remote(self) -> List[DesktopInstance]:
-        instances = self.ec2.instances.filter(
-            Filters=[{"Name": "instance-state-name", "Values": ["running", "stopped"]}]
-        )
-        desktops = []
-        for instance in instances:
-            desktops.append(DesktopInstance.load(instance.id))
-        return desktops
+        ids = [instance.id for instance in self._index_instances_by_name().values()]
+        if not ids:
+            return []
+        by_id = {
+            desktop.id: desktop for desktop in DesktopInstance.find(id=("in", ids))
+        }
+        return [by_id[id] for id in ids if id in by_id]
 
     def list(self) -> List[DesktopInstance]:
         return DesktopInstance.find()
@@ -488,43 +674,88 @@ users:
     def _get_instance_by_name(
         self, name: str, owner_id: Optional[str] = None
     ) -> Optional[EC2Instance]:
+        instance_id = self._name_to_id.get(name)
+        if instance_id:
+            # Loading a known id is lighter than a filtered describe
+            instance = self.ec2.Instance(instance_id)
+            try:
+                instance.load()
+                tags = {tag["Key"]: tag["Value"] for tag in instance.tags or []}
+                if tags.get("Name") == name and (
+                    owner_id is None or tags.get("Owner") == owner_id
+                ):
+                    return instance
+            except ClientError as e:
+                logger.debug(f"cached instance {instance_id} for {name} gone: {e}")
+            self._name_to_id.pop(name, None)
+
         filters = [{"Name": "tag:Name", "Values": [name]}]
 
         if owner_id is not None:
-            filters.append({"Name": "Owner", "Values": [owner_id]})
+            filters.append({"Name": "tag:Owner", "Values": [owner_id]})
 
         instances = self.ec2.instances.filter(Filters=filters)  # type: ignore
 
         return next((instance for instance in instances), None)
 
+    def _index_instances_by_name(self) -> Dict[str, EC2Instance]:
+        """Map names to the live agentdesk instances, with one describe call"""
+        instances = self.ec2.instances.filter(
+            Filters=[
+                {"Name": "tag:provisioner", "Values": ["agentdesk"]},
+                {
+                    "Name": "instance-state-name",
+                    "Values": ["pending", "running", "stopping", "stopped"],
+                },
+            ]
+        )
+        by_name = {}
+        for instance in instances:
+            for tag in instance.tags or []:
+                if tag["Key"] == "Name":
+                    by_name[tag["Value"]] = instance
+                    break
+        self._name_to_id.clear()
+        self._name_to_id.update((name, inst.id) for name, inst in by_name.items())
+        return by_name
+
     def _get_root_device_size(self, instance: EC2Instance) -> str:
         for device in instance.block_device_mappings:
             if device.get("DeviceName") == instance.root_device_name:
                 volume_id = device.get("Ebs", {}).get("VolumeId")
                 if volume_id:
-                    volume = boto3.resource("ec2").Volume(volume_id)
+                    volume = self.ec2.Volume(volume_id)
                     return f"{volume.size}gb"
         return "unknown"
 
     def refresh(self, log: bool = True) -> None:
         """Refresh state"""
-        for vm in DesktopInstance.find():
+        removed = []
+        updated = []
+        instances = self._index_instances_by_name()
+        for vm in DesktopInstance.find(provider_type="ec2"):
             if not vm.provider:
                 continue
             if vm.provider.type != "ec2":
                 continue
+            # Only this region was listed, leave desktops elsewhere alone
+            if (vm.provider.args or {}).get("region", "us-east-1") != self.region:
+                continue
 
-            instance = self._get_instance_by_name(vm.name)
+            instance = instances.get(vm.name)
             if not instance:
                 if log:
                     print(f"removing vm '{vm.name}' from state")
-                vm.remove()
-                return
+                removed.append(vm.id)
+                continue
 
             if not vm.reserved_ip:
                 if vm.addr != instance.public_ip_address:
                     if log:
                         print(f"updating vm '{vm.name}' state")
                     vm.addr = instance.public_ip_address
-                    vm.save()
-                    return
+                    updated.append(vm)
+
+        # Write back in one transaction each rather than one per vm
+        DesktopInstance.remove_many(removed)
+        DesktopInstance.save_many(updated)
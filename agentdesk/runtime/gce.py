@@ -1,27 +1,79 @@
 from __future__ import annotations
 
-import atexit
+import copy
+import functools
 import json
 import logging
 import re
-import time
-from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
-import requests
+from google.api_core.future import polling
 from google.cloud import _helpers, compute_v1
 from google.oauth2.service_account import Credentials
 from namesgenerator import get_random_name
 
 from agentdesk.key import SSHKeyPair
-from agentdesk.proxy import cleanup_proxy, ensure_ssh_proxy
 from agentdesk.server.models import V1ProviderData
-from agentdesk.util import find_open_port, generate_random_string, generate_short_hash
+from agentdesk.util import generate_random_string, generate_short_hash
 
 from .base import DesktopProvider, DesktopInstance
-from .img import JAMMY
+from .img import IMAGE_REGISTRY, JAMMY
 
 logger = logging.getLogger(__name__)
 
+_GCS_URL_RE = re.compile(r"gs://([^/]+)/(.+)")
+_IMG_NAME_SANITIZE_RE = re.compile(r"[^a-zA-Z0-9-]")
+
+# Partial responses, only the fields read back are sent. The list mask
+# keeps nextPageToken so paging still works
+_GET_INSTANCE_FIELDS = (
+    ("x-goog-fieldmask", "id,networkInterfaces/accessConfigs/natIP"),
+)
+_LIST_INSTANCE_FIELDS = (
+    (
+        "x-goog-fieldmask",
+        "nextPageToken,items/*/instances(name,status,networkInterfaces/accessConfigs/natIP)",
+    ),
+)
+
+# Long-running operations are polled with backoff, from 1s up to 10s between
+# polls, for at most 10 minutes
+_OPERATION_POLLING = polling.DEFAULT_POLLING.with_delay(
+    initial=1.0, maximum=10.0, multiplier=1.5
+).with_timeout(600)
+
+# (project, image) pairs seen READY, images don't go back from ready
+_READY_IMAGES: Set[Tuple[str, str]] = set()
+
+
+@functools.lru_cache(maxsize=1)
+def _default_project_id() -> Optional[str]:
+    # Resolving it may shell out to gcloud or call the metadata server
+    return _helpers._determine_default_project()
+
+
+@functools.lru_cache(maxsize=None)
+def _credentials(credentials_json: Optional[str]) -> Optional[Credentials]:
+    if not credentials_json:
+        return None
+    return Credentials.from_service_account_info(json.loads(credentials_json))
+
+
+@functools.lru_cache(maxsize=None)
+def _client(client_cls: type, credentials_json: Optional[str]) -> Any:
+    """One client of a type per set of credentials, shared process wide"""
+    return client_cls(credentials=_credentials(credentials_json))
+
+
+def _nat_ip(instance: compute_v1.Instance) -> Optional[str]:
+    """External address of an instance, None if it has none e.g. while stopped"""
+    for interface in instance.network_interfaces:
+        for access_config in interface.access_configs:
+            if access_config.nat_i_p:
+                return access_config.nat_i_p
+    return None
+
 
 class GCEProvider(DesktopProvider):
     """VM provider using GCP Compute Engine"""
@@ -34,16 +86,34 @@ class GCEProvider(DesktopProvider):
         gcp_credentials_json: Optional[str] = None,
     ):
         """Initialize the GCP VM Provider with project, zone, region, and optional JSON credentials."""
-        self.project_id = project_id or _helpers._determine_default_project()
+        self.project_id = project_id or _default_project_id()
         self.zone = zone
         self.region = region
-        if gcp_credentials_json:
-            credentials_info = json.loads(gcp_credentials_json)
-            self.credentials = Credentials.from_service_account_info(credentials_info)
-        else:
-            self.credentials = None
+        self._credentials_json = gcp_credentials_json
+        self.credentials = _credentials(gcp_credentials_json)
+        self._save_desktops = True
         # print("using project id: ", self.project_id)
 
+    # Clients own a channel and resolve credentials when built, so they are
+    # shared by every provider using the same credentials, e.g. the ones
+    # rebuilt from data on each list or refresh
+
+    @functools.cached_property
+    def instances_client(self) -> compute_v1.InstancesClient:
+        return _client(compute_v1.InstancesClient, self._credentials_json)
+
+    @functools.cached_property
+    def images_client(self) -> compute_v1.ImagesClient:
+        return _client(compute_v1.ImagesClient, self._credentials_json)
+
+    @functools.cached_property
+    def addresses_client(self) -> compute_v1.AddressesClient:
+        return _client(compute_v1.AddressesClient, self._credentials_json)
+
+    @functools.cached_property
+    def firewalls_client(self) -> compute_v1.FirewallsClient:
+        return _client(compute_v1.FirewallsClient, self._credentials_json)
+
     def create(
         self,
         name: Optional[str] = None,
@@ -84,24 +154,37 @@ class GCEProvider(DesktopProvider):
         if password:
             raise NotImplementedError("password not implemented for gce provider")
 
-        if not image:
-            image = JAMMY.gce
+        registered = IMAGE_REGISTRY.get(image or JAMMY.name)
+        if registered:
+            image = registered.gce
 
         # bucket_name, image_file = self._parse_gcs_url(image)
         # image_name = self._generate_image_name_from_gcs_url(image)
 
-        images_client = compute_v1.ImagesClient(credentials=self.credentials)
-
         # Ensure the image_project_id is set to the correct public project
         image_project_id = "agentsea-dev"
         source_image_url = f"projects/{image_project_id}/global/images/{image}"
 
-        # Check if the image exists
-        img = images_client.get(project=image_project_id, image=image)
-        if img.status != "READY":
-            raise ValueError("Image is not ready")
-
-        instance_client = compute_v1.InstancesClient(credentials=self.credentials)
+        # Check if the image exists, overlapping the address reservation
+        # when one is needed as the two are independent
+        ip_name = f"{name}-ip"
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            img_future = executor.submit(self._image_ready, image_project_id, image)
+            ip_future = (
+                executor.submit(self.reserve_static_ip, ip_name) if reserve_ip else None
+            )
+            try:
+                if not img_future.result():
+                    raise ValueError("Image is not ready")
+            except Exception:
+                # A reserved address is billed, don't keep one for a vm
+                # which won't be created
+                if ip_future and ip_future.exception() is None:
+                    self.release_static_ip(ip_name)
+                raise
+            reserved_ip = ip_future.result() if ip_future else None
+
+        instance_client = self.instances_client
         machine_type = f"zones/{self.zone}/machineTypes/custom-{cpu}-{memory * 1024}"
 
         disk_config = compute_v1.AttachedDiskInitializeParams(
@@ -129,8 +212,6 @@ class GCEProvider(DesktopProvider):
                 owner_id or "local",
                 metadata={"generated_for": name},
             )
-            public_ssh_key = key_pair.public_key
-            private_ssh_key = key_pair.decrypt_private_key(key_pair.private_key)
         else:
             key_pairs = SSHKeyPair.find(name=ssh_key_pair, owner_id=owner_id or "local")
             if not key_pairs:
@@ -138,7 +219,7 @@ class GCEProvider(DesktopProvider):
             key_pair = key_pairs[0]
 
         public_ssh_key = key_pair.public_key
-        private_ssh_key = key_pair.decrypt_private_key(key_pair.private_key)
+        private_ssh_key = key_pair.decrypted_private_key
 
         if not metadata:
             metadata = {}
@@ -165,9 +246,7 @@ class GCEProvider(DesktopProvider):
             metadata=_metadata,
         )
 
-        if reserve_ip:
-            static_ip_name = f"{name}-ip"
-            reserved_ip = self.reserve_static_ip(static_ip_name)
+        if reserved_ip:
             access_config = compute_v1.AccessConfig(
                 nat_ip=reserved_ip, name="External NAT"
             )
@@ -176,19 +255,31 @@ class GCEProvider(DesktopProvider):
         operation = instance_client.insert(
             project=self.project_id, zone=self.zone, instance_resource=instance
         )
-        operation.result()
+        operation.result(polling=_OPERATION_POLLING)
 
-        created_instance = instance_client.get(
-            project=self.project_id, zone=self.zone, instance=name
-        )
-        ip_address = created_instance.network_interfaces[0].access_configs[0].nat_i_p
+        # The finished operation carries the instance id, and a reserved
+        # address is already known, so only an ephemeral one needs a get
+        instance_id = str(operation.target_id)
+        if reserved_ip:
+            ip_address = reserved_ip
+        else:
+            created_instance = instance_client.get(
+                project=self.project_id,
+                zone=self.zone,
+                instance=name,
+                metadata=_GET_INSTANCE_FIELDS,
+            )
+            instance_id = str(created_instance.id)
+            ip_address = (
+                created_instance.network_interfaces[0].access_configs[0].nat_i_p
+            )
 
         # Wait for the VM to be ready
         self._wait_till_ready(ip_address, private_ssh_key=private_ssh_key)
 
         new_desktop = DesktopInstance(
             name=name,
-            id=str(created_instance.id),
+            id=instance_id,
             addr=ip_address,
             cpu=cpu,
             memory=memory,  # type: ignore
@@ -199,74 +290,60 @@ class GCEProvider(DesktopProvider):
             owner_id=owner_id,
             metadata=metadata,
             key_pair_name=key_pair.name,
+            reserved_ip=reserve_ip,
             ttl=ttl,
+            save=self._save_desktops,
         )
         print(f"\nsuccessfully created desktop '{name}'")
         return new_desktop
 
-    def _wait_till_ready(
-        self,
-        addr: str,
-        local_agentd_port: Optional[int] = None,
-        private_ssh_key: Optional[str] = None,
-    ) -> None:
-        print("waiting for desktop to be ready...")
-        if not local_agentd_port:
-            local_agentd_port = find_open_port(8000, 9000)
-            if not local_agentd_port:
-                raise ValueError("could not find local port")
-
-        ready = False
-        while not ready:
-            print("waiting for desktop to be ready...")
-            time.sleep(3)
-            try:
-                logger.debug("ensuring up ssh proxy...")
-                pid = ensure_ssh_proxy(
-                    local_port=local_agentd_port,
-                    remote_port=8000,
-                    ssh_host=addr,
-                    ssh_key=private_ssh_key,
-                    log_error=False,
-                )
-                atexit.register(cleanup_proxy, pid)
-
-                logger.debug("calling agentd...")
-                response = requests.get(f"http://localhost:{local_agentd_port}/health")
-                logger.debug(f"agentd response: {response}")
-                if response.status_code == 200:
-                    ready = True
-
-                cleanup_proxy(pid)
-                atexit.unregister(cleanup_proxy)
-            except Exception as e:
-                logger.debug(f"Exception while waiting for desktop to be ready: {e}")
-                try:
-                    cleanup_proxy(pid, log_error=False)  # type: ignore
-                    atexit.unregister(cleanup_proxy)
-                except Exception:
-                    pass
+    def _batch_creates(self, count: int) -> List[Callable[..., DesktopInstance]]:
+        # Build the clients before copying so every create shares them, the
+        # inserts and operation waits then run side by side
+        for client in ("images_client", "instances_client", "addresses_client"):
+            getattr(self, client)
+        worker = copy.copy(self)
+        worker._save_desktops = False
+        return [worker.create] * count
+
+    def _image_ready(self, project: str, image: str) -> bool:
+        """Check whether an image is ready, remembering the ones that are"""
+        if (project, image) in _READY_IMAGES:
+            return True
+        img = self.images_client.get(project=project, image=image)
+        if img.status != "READY":
+            return False
+        # Only ready images are cached, one still pending is checked again
+        _READY_IMAGES.add((project, image))
+        return True
 
     def reserve_static_ip(self, name: str) -> str:
         """Reserve a static external IP address."""
-        addresses_client = compute_v1.AddressesClient(credentials=self.credentials)
+        addresses_client = self.addresses_client
         address = compute_v1.Address(name=name)
 
         operation = addresses_client.insert(
             project=self.project_id, region=self.region, address_resource=address
         )
-        operation.result()
+        operation.result(polling=_OPERATION_POLLING)
 
         reserved_address = addresses_client.get(
             project=self.project_id, region=self.region, address=name
         )
         return reserved_address.address
 
+    def release_static_ip(self, name: str) -> None:
+        """Release a reserved static external IP address."""
+        operation = self.addresses_client.delete(
+            project=self.project_id, region=self.region, address=name
+        )
+        operation.result(polling=_OPERATION_POLLING)
+
     def open_firewall(
         self, rule_name: str, ports: List[str], network: str = "global/networks/default"
     ):
         """Create a firewall rule to allow incoming traffic on specified ports."""
-        firewall_client = compute_v1.FirewallsClient(credentials=self.credentials)
+        firewall_client = self.firewalls_client
         firewall = compute_v1.Firewall()
         firewall.name = rule_name
         firewall.direction = compute_v1.Firewall.Direction.INGRESS  # type: ignore
@@ -276,11 +353,11 @@ class GCEProvider(DesktopProvider):
         operation = firewall_client.insert(
             project=self.project_id, firewall_resource=firewall
         )
-        return operation.result()
+        return operation.result(polling=_OPERATION_POLLING)
 
     def _parse_gcs_url(self, gcs_url: str) -> Tuple[str, str]:
         """Extract the bucket name and image file from a GCS URL."""
-        match = re.match(r"gs://([^/]+)/(.+)", gcs_url)
+        match = _GCS_URL_RE.match(gcs_url)
         if match:
             return match.group(1), match.group(2)
         raise ValueError("Invalid GCS URL format")
@@ -288,7 +365,7 @@ class GCEProvider(DesktopProvider):
     def _generate_image_name_from_gcs_url(self, gcs_url: str) -> str:
         """Generate a unique image name based on the GCS URL."""
         _, image_file = self._parse_gcs_url(gcs_url)
-        return re.sub(r"[^a-zA-Z0-9-]", "-", image_file)
+        return _IMG_NAME_SANITIZE_RE.sub("-", image_file)
 
     def _parse_machine_type(self, machine_type: str) -> Tuple[int, str]:
         """Parse the machine type to extract CPU and memory info.
@@ -310,13 +387,14 @@ class GCEProvider(DesktopProvider):
         if not desktop:
             raise ValueError(f"Desktop {name} not found")
 
-        instance_client = compute_v1.InstancesClient(credentials=self.credentials)
+        instance_client = self.instances_client
         operation = instance_client.delete(
             project=self.project_id,
             zone=self.zone,
             instance=name,
         )
-        operation.result()  # Wait for operation to complete
+        # Wait for operation to complete
+        operation.result(polling=_OPERATION_POLLING)
 
         # Delete the Desktop record
         desktop.remove()
@@ -340,15 +418,19 @@ class GCEProvider(DesktopProvider):
         desk = DesktopInstance.get(name, owner_id=owner_id)
         if not desk:
             raise ValueError(f"Desktop {name} not found")
-        instance_client = compute_v1.InstancesClient(credentials=self.credentials)
+        instance_client = self.instances_client
         operation = instance_client.start(
             project=self.project_id,
             zone=self.zone,
             instance=name,
         )
-        operation.result()  # Wait for the operation to complete
+        # Wait for the operation to complete
+        operation.result(polling=_OPERATION_POLLING)
         created_instance = instance_client.get(
-            project=self.project_id, zone=self.zone, instance=name
+            project=self.project_id,
+            zone=self.zone,
+            instance=name,
+            metadata=_GET_INSTANCE_FIELDS,
         )
         ip_address = created_instance.network_interfaces[0].access_configs[0].nat_i_p
         desk.addr = ip_address
@@ -361,18 +443,85 @@ class GCEProvider(DesktopProvider):
         desk = DesktopInstance.get(name, owner_id=owner_id)
         if not desk:
             raise ValueError(f"Desktop {name} not found")
-        instance_client = compute_v1.InstancesClient(credentials=self.credentials)
+        instance_client = self.instances_client
         operation = instance_client.stop(
             project=self.project_id,
             zone=self.zone,
             instance=name,
         )
-        operation.result()  # Wait for the operation to complete
+        # Wait for the operation to complete
+        operation.result(polling=_OPERATION_POLLING)
         desk.status = "stopped"
         desk.save()
 
+    def start_many(
+        self,
+        names: List[str],
+        owner_id: Optional[str] = None,
+        max_workers: int = 8,
+    ) -> None:
+        """Start several desktops concurrently.
+
+        Args:
+            names (List[str]): Names of the desktops.
+            owner_id (Optional[str], optional): Owner of the desktops. Defaults to None.
+            max_workers (int, optional): Max desktops being started at once. Defaults to 8.
+        """
+        self._run_many(self.start, names, max_workers, owner_id=owner_id)
+
+    def stop_many(
+        self,
+        names: List[str],
+        owner_id: Optional[str] = None,
+        max_workers: int = 8,
+    ) -> None:
+        """Stop several desktops concurrently.
+
+        Args:
+            names (List[str]): Names of the desktops.
+            owner_id (Optional[str], optional): Owner of the desktops. Defaults to None.
+            max_workers (int, optional): Max desktops being stopped at once. Defaults to 8.
+        """
+        self._run_many(self.stop, names, max_workers, owner_id=owner_id)
+
+    def delete_many(
+        self,
+        names: List[str],
+        owner_id: Optional[str] = None,
+        max_workers: int = 8,
+    ) -> None:
+        """Delete several desktops concurrently.
+
+        Args:
+            names (List[str]): Names of the desktops.
+            owner_id (Optional[str], optional): Owner of the desktops. Defaults to None.
+            max_workers (int, optional): Max desktops being deleted at once. Defaults to 8.
+        """
+        self._run_many(self.delete, names, max_workers, owner_id=owner_id)
+
+    def _run_many(
+        self,
+        fn: Callable[..., Any],
+        names: List[str],
+        max_workers: int,
+        **kwargs: Any,
+    ) -> None:
+        """Run a per-desktop operation for every name concurrently"""
+        # Clients are shared by the threads, build them before they start
+        self.instances_client
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(fn, name, **kwargs) for name in names]
+            errors = []
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+
     def list(self) -> List[DesktopInstance]:
-        desktops = DesktopInstance.find()
+        desktops = DesktopInstance.find(provider_type="gce")
         out = []
         for desktop in desktops:
             if not desktop.provider:
@@ -420,40 +569,49 @@ class GCEProvider(DesktopProvider):
 
     def refresh(self, log: bool = True) -> None:
         """Refresh the state of all VMs managed by this GCEProvider."""
-        instance_client = compute_v1.InstancesClient(credentials=self.credentials)
+        instance_client = self.instances_client
 
-        # List all instances in the project and zone
-        request = compute_v1.ListInstancesRequest(
+        # One paged call lists agentdesk instances in every zone of the
+        # project, keyed by zone and name. The listing already carries address
+        # and status, so no per-vm get is needed
+        request = compute_v1.AggregatedListInstancesRequest(
             project=self.project_id,
-            zone=self.zone,
+            filter="labels.provisioner = agentdesk",
+            max_results=500,
+        )
+        gce_instances = {}
+        pages = instance_client.aggregated_list(
+            request=request, metadata=_LIST_INSTANCE_FIELDS
         )
-        response = instance_client.list(request=request)
-        # Build a list of all GCE instance names for comparison
-        gce_instance_names = [instance.name for instance in response]
+        for scope, scoped_list in pages:
+            zone = scope.rsplit("/", 1)[-1]
+            for instance in scoped_list.instances:
+                gce_instances[(zone, instance.name)] = instance
 
+        removed = []
+        updated = []
         # Iterate over all DesktopInstance instances managed by this provider
-        for vm in DesktopInstance.find():
+        for vm in DesktopInstance.find(provider_type="gce"):
             if not vm.provider:
                 continue
             if vm.provider.type != "gce":
                 continue
+            args = vm.provider.args or {}
+            # Only this project was listed, leave desktops elsewhere alone
+            if args.get("project_id", self.project_id) != self.project_id:
+                continue
 
             # Check if the VM still exists in GCE
-            if vm.name not in gce_instance_names:
+            instance = gce_instances.get((args.get("zone", self.zone), vm.name))
+            if not instance:
                 # VM no longer exists in GCE, so remove it
                 if log:
                     print(f"removing vm '{vm.name}' from state")
-                vm.remove()
-                return
+                removed.append(vm.id)
             else:
-                # VM exists, update its details
-                instance = instance_client.get(
-                    project=self.project_id,
-                    zone=self.zone,
-                    instance=vm.name,
-                )
-                # Assuming the first network interface and access config is used for the public IP
-                remote_addr = instance.network_interfaces[0].access_configs[0].nat_i_p
+                # VM exists, update its details. A stopped vm or one without
+                # an external NAT has no address, it is cleared
+                remote_addr = _nat_ip(instance)
                 remote_status = "running" if instance.status == "RUNNING" else "stopped"
 
                 if remote_status != vm.status or remote_addr != vm.addr:
@@ -461,5 +619,8 @@ class GCEProvider(DesktopProvider):
                         print(f"updating vm '{vm.name}' state")
                     vm.status = remote_status
                     vm.addr = remote_addr
-                    vm.save()
-                return
+                    updated.append(vm)
+
+        # Write back in one transaction each rather than one per vm
+        DesktopInstance.remove_many(removed)
+        DesktopInstance.save_many(updated)
@@ -1,8 +1,8 @@
 from dataclasses import dataclass
-from typing import Optional
+from typing import Dict, Optional
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Image:
     """A desktop vm image"""
 
@@ -20,3 +20,7 @@ JAMMY = Image(
     ec2="agentd-ubuntu-22.04-20240529073401-patch1",
     qcow2="https://storage.googleapis.com/agentsea-vms/jammy/agentd-ubuntu-qemu-07202412121737-patch1.qcow2",
 )
+
+# Images by name, providers resolve a registered name, or no image, to their
+# own build of it and take anything else as one of their images
+IMAGE_REGISTRY: Dict[str, Image] = {JAMMY.name: JAMMY}
@@ -535,7 +535,7 @@ class KubernetesProvider(DesktopProvider):
         Returns:
             List[DesktopInstance]: A list of desktops
         """
-        desktops = DesktopInstance.find()
+        desktops = DesktopInstance.find(provider_type="kube")
 
         out = []
         for desktop in desktops:
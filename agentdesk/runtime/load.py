@@ -1,23 +1,30 @@
-from .ec2 import EC2Provider
-from .gce import GCEProvider
-from .qemu import QemuProvider
-from .docker import DockerProvider
-from .kube import KubernetesProvider
 from .base import DesktopProvider
 from agentdesk.server.models import V1ProviderData
 
 
 def load_provider(data: V1ProviderData) -> DesktopProvider:
     """Load a DesktopProvider from a dictionary."""
+    # Providers are imported on use so their optional SDKs are only loaded,
+    # and only required, for the provider being loaded
     if data.type == "ec2":
+        from .ec2 import EC2Provider
+
         return EC2Provider.from_data(data)
     elif data.type == "gce":
+        from .gce import GCEProvider
+
         return GCEProvider.from_data(data)
     elif data.type == "qemu":
+        from .qemu import QemuProvider
+
         return QemuProvider.from_data(data)
     elif data.type == "docker":
+        from .docker import DockerProvider
+
         return DockerProvider.from_data(data)
     elif data.type == "kube":
+        from .kube import KubernetesProvider
+
         return KubernetesProvider.from_data(data)
     else:
         raise ValueError(f"Unknown provider type: {data.type}")
@@ -1,25 +1,23 @@
 from __future__ import annotations
+import hashlib
+import io
 import subprocess
 import psutil
-from typing import List, Optional, Dict, Any
+from typing import BinaryIO, List, Optional, Dict, Any
 import os
 from urllib.parse import urlparse
-import tempfile
-import time
 import signal
 import logging
 import shutil
-import atexit
 
 import pycdlib
 import requests
 from namesgenerator import get_random_name
 from tqdm import tqdm
 from agentdesk.key import SSHKeyPair
-from agentdesk.proxy import ensure_ssh_proxy, cleanup_proxy
 
 from .base import DesktopInstance, DesktopProvider
-from .img import JAMMY
+from .img import IMAGE_REGISTRY, JAMMY
 from agentdesk.server.models import V1ProviderData
 from agentdesk.config import AGENTSEA_HOME
 from agentdesk.util import (
@@ -32,8 +30,43 @@ from agentdesk.util import (
 META_PYTHON_IMAGE = "python:3.9-slim"
 META_CONTAINER_NAME = "http_server"
 
+# Read size when downloading images
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class _HashingWriter:
+    """File wrapper which hashes everything written through it"""
+
+    def __init__(self, f: BinaryIO, digest: Any) -> None:
+        self.f = f
+        self.digest = digest
+
+    def write(self, data: bytes) -> int:
+        self.digest.update(data)
+        return self.f.write(data)
+
+
+def _file_sha256(path: str) -> Any:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest
+
+
 logger = logging.getLogger(__name__)
 
+# QEMU processes started by this process, by desktop name. They are our
+# children, so once one exits it lingers as a zombie until waited on
+_VM_PROCESSES: Dict[str, subprocess.Popen] = {}
+
+
+def _reap_vms() -> None:
+    """Wait on started QEMU processes which have exited"""
+    for name, process in list(_VM_PROCESSES.items()):
+        if process.poll() is not None:
+            _VM_PROCESSES.pop(name, None)
+
 
 class QemuProvider(DesktopProvider):
     """A VM provider using local QEMU virtual machines."""
@@ -87,10 +120,11 @@ class QemuProvider(DesktopProvider):
         vm_dir = os.path.join(AGENTSEA_HOME, "vms")
         os.makedirs(vm_dir, exist_ok=True)
 
-        if not image:
-            image = JAMMY.qcow2
-            image_name = JAMMY.name
-        elif image.startswith("https://"):
+        registered = IMAGE_REGISTRY.get(image or JAMMY.name)
+        if registered:
+            image = registered.qcow2
+            image_name = registered.name
+        elif image.startswith("https://"):  # type: ignore
             parsed_url = urlparse(image)
             image_name = parsed_url.hostname + parsed_url.path.replace(  # type: ignore
                 "/", "_"
@@ -105,19 +139,11 @@ class QemuProvider(DesktopProvider):
 
         base_image_path = os.path.join(vm_dir, image_name)
 
-        # Download image only if it does not exist
-        if not os.path.exists(base_image_path) and image.startswith("https://"):  # type: ignore
-            print(f"Downloading image '{image}'...")
-            response = requests.get(image, stream=True)  # type: ignore
-            total_size_in_bytes = int(response.headers.get("content-length", 0))
-            block_size = 8192  # Size of each chunk
-
-            progress_bar = tqdm(total=total_size_in_bytes, unit="iB", unit_scale=True)
-            with open(base_image_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=block_size):
-                    progress_bar.update(len(chunk))
-                    f.write(chunk)
-            progress_bar.close()
+        # Download image only if there isn't an intact copy already
+        if image.startswith("https://") and not self._image_current(  # type: ignore
+            image, base_image_path  # type: ignore
+        ):
+            self._download_image(image, base_image_path)  # type: ignore
 
         image_path = os.path.join(vm_dir, f"{name}.qcow2")
         shutil.copy(base_image_path, image_path)
@@ -129,8 +155,6 @@ class QemuProvider(DesktopProvider):
                 owner_id or "local",
                 metadata={"generated_for": name},
             )
-            public_ssh_key = key_pair.public_key
-            private_ssh_key = key_pair.decrypt_private_key(key_pair.private_key)
         else:
             key_pairs = SSHKeyPair.find(name=ssh_key_pair, owner_id=owner_id or "local")
             if not key_pairs:
@@ -138,7 +162,7 @@ class QemuProvider(DesktopProvider):
             key_pair = key_pairs[0]
 
         public_ssh_key = key_pair.public_key
-        private_ssh_key = key_pair.decrypt_private_key(key_pair.private_key)
+        private_ssh_key = key_pair.decrypted_private_key
 
         # Generate user-data
         user_data = f"""#cloud-config
@@ -156,48 +180,55 @@ local-hostname: {name}
 
         ssh_port = find_open_port(2222, 3333)
 
-        self._create_iso("cidata.iso", user_data, meta_data)
-
-        pid_file = f"{name}.pid"  # File to store the PID
-
-        command = (
-            f"nohup qemu-system-x86_64 -nographic -hda {image_path} -m {memory}G "
-            f"-smp {cpu} -netdev user,id=vmnet,hostfwd=tcp::{ssh_port}-:22 "
-            "-device e1000,netdev=vmnet "
-            f"-cdrom cidata.iso >/dev/null 2>&1 & echo $! > {pid_file}"
-        )
+        # One seed iso per vm, next to its disk, so concurrent creates don't
+        # overwrite each other's
+        iso_path = os.path.join(vm_dir, f"{name}-cidata.iso")
+        self._create_iso(iso_path, user_data, meta_data)
+
+        command = [
+            "qemu-system-x86_64",
+            "-nographic",
+            "-hda",
+            image_path,
+            "-m",
+            f"{memory}G",
+            "-smp",
+            str(cpu),
+            "-netdev",
+            f"user,id=vmnet,hostfwd=tcp::{ssh_port}-:22",
+            "-device",
+            "e1000,netdev=vmnet",
+            "-cdrom",
+            iso_path,
+        ]
 
         # Set environment variables
         env = os.environ.copy()
         env["AGENTDESK"] = name
 
-        # Start the QEMU process
-        try:
-            if self.log_vm:
-                process = subprocess.Popen(command, shell=True)
-                pid = process.pid
-            else:
-                subprocess.run(command, shell=True, env=env, check=True)
-                self._wait_till_ready(ssh_port, private_ssh_key)  # type: ignore
-
-                # Read the PID from the file
-                with open(pid_file, "r") as file:
-                    pid = int(file.read().strip())
-
-                os.remove(pid_file)
-
-            self._wait_till_ready(ssh_port, private_ssh_key)  # type: ignore
+        # Start the QEMU process in its own session, so it outlives us like
+        # under nohup and its process group can be signalled as a whole
+        output = None if self.log_vm else subprocess.DEVNULL
+        process = subprocess.Popen(
+            command,
+            stdin=output,
+            stdout=output,
+            stderr=output,
+            env=env,
+            start_new_session=True,
+        )
+        pid = process.pid
+        _VM_PROCESSES[name] = process
 
-        except subprocess.CalledProcessError as e:
-            print(f"Command '{command}' returned non-zero exit status {e.returncode}.")
-            raise
+        try:
+            self._wait_till_ready("localhost", ssh_port, private_ssh_key)  # type: ignore
         except KeyboardInterrupt:
             print("Keyboard interrupt received, terminating process...")
-            os.killpg(os.getpgid(process.pid), signal.SIGINT)  # type: ignore
+            os.killpg(process.pid, signal.SIGINT)
             raise
         except Exception as e:
             print(f"An error occurred: {e}")
-            os.killpg(os.getpgid(process.pid), signal.SIGINT)  # type: ignore
+            os.killpg(process.pid, signal.SIGINT)
             raise
 
         print("connected to desktop")
@@ -223,68 +254,113 @@ local-hostname: {name}
         print(f"\nsuccessfully created desktop '{name}'")
         return desktop
 
-    def _wait_till_ready(
-        self, ssh_port: int, private_ssh_key: Optional[str] = None
-    ) -> None:
-        local_agentd_port = find_open_port(8000, 9000)
-        if not local_agentd_port:
-            raise ValueError("could not find open port")
-        print("waiting for desktop to be ready...")
-
-        ready = False
-        while not ready:
-            print("waiting for desktop to be ready...")
-            time.sleep(3)
-            try:
-                try:
-                    logger.debug("ensuring up ssh proxy...")
-                    pid = ensure_ssh_proxy(
-                        local_port=local_agentd_port,
-                        remote_port=8000,
-                        ssh_host="localhost",
-                        ssh_key=private_ssh_key,
-                        ssh_port=ssh_port,
-                        log_error=False,
-                    )
-                    atexit.register(cleanup_proxy, pid)
-                except Exception:
-                    try:
-                        cleanup_proxy(pid, log_error=False)  # type: ignore
-                    except Exception:
-                        pass
-                logger.debug("calling agentd...")
-                response = requests.get(f"http://localhost:{local_agentd_port}/health")
-                logger.debug(f"agentd response: {response}")
-                if response.status_code == 200:
-                    ready = True
-            except Exception as e:
-                logger.debug(f"agentd error: {e}")
+    def _download_image(self, url: str, path: str) -> None:
+        """Download a vm image, streaming it straight to disk.
+
+        The image is written to `<path>.part` and only moved to `path` once
+        complete, an interrupted download is resumed from the partial file.
+        Its sha256 is computed while writing, checked against the one
+        published next to the image if any, and kept in `<path>.sha256`.
+        """
+        part_path = path + ".part"
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        # Sizes, resume offsets and the hash all count the bytes as sent, so
+        # ask for them unencoded
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+
+        print(f"Downloading image '{url}'...")
+        with requests.get(url, stream=True, headers=headers) as response:
+            if offset and response.status_code == 416:
+                # The partial file doesn't fit the image, start over
+                os.remove(part_path)
+                return self._download_image(url, path)
+            response.raise_for_status()
+            if response.status_code != 206:
+                # The server sent the whole image
+                offset = 0
+            content_length = response.headers.get("content-length")
+            expected_size = offset + int(content_length) if content_length else None
+
+            # A resumed download's hash starts from the bytes already on disk
+            digest = _file_sha256(part_path) if offset else hashlib.sha256()
+
+            # The copy runs in 1 MiB reads, the bar is updated by each read
+            with tqdm.wrapattr(
+                response.raw,
+                "read",
+                total=expected_size,
+                initial=offset,
+                unit="iB",
+                unit_scale=True,
+            ) as source, open(part_path, "ab" if offset else "wb") as f:
+                shutil.copyfileobj(
+                    source, _HashingWriter(f, digest), length=_DOWNLOAD_CHUNK_SIZE
+                )
+
+        size = os.path.getsize(part_path)
+        if expected_size is not None and size != expected_size:
+            raise IOError(
+                f"Downloaded {size} bytes of '{url}', expected {expected_size}. "
+                "Run again to resume the download."
+            )
+
+        sha256 = digest.hexdigest()
+        expected_sha256 = self._published_sha256(url)
+        if expected_sha256 and sha256 != expected_sha256:
+            os.remove(part_path)
+            raise IOError(
+                f"Downloaded image '{url}' has sha256 {sha256}, expected {expected_sha256}"
+            )
+        with open(path + ".sha256", "w") as f:
+            f.write(sha256)
+        os.replace(part_path, path)
+
+    def _image_current(self, url: str, path: str) -> bool:
+        """Check whether a downloaded image exists and matches its published hash"""
+        if not os.path.exists(path):
+            return False
+        expected_sha256 = self._published_sha256(url)
+        if not expected_sha256:
+            # Nothing to check against, trust the complete download
+            return True
+        sha_path = path + ".sha256"
+        if not os.path.exists(sha_path):
+            # Downloaded before hashes were kept, hash it once
+            with open(sha_path, "w") as f:
+                f.write(_file_sha256(path).hexdigest())
+        with open(sha_path) as f:
+            return f.read().strip() == expected_sha256
+
+    def _published_sha256(self, url: str) -> Optional[str]:
+        """The sha256 published at `<url>.sha256`, if there is one"""
+        try:
+            response = requests.get(url + ".sha256", timeout=(3, 10))
+        except requests.RequestException as e:
+            logger.debug(f"could not fetch sha256 for {url}: {e}")
+            return None
+        if response.status_code != 200 or not response.text.strip():
+            return None
+        return response.text.split()[0].lower()
 
     def _create_iso(self, output_iso: str, user_data: str, meta_data: str) -> None:
         iso = pycdlib.PyCdlib()  # type: ignore
         iso.new(joliet=3, rock_ridge="1.09", vol_ident="cidata")
 
-        # Use the tempfile module to create temporary files for user-data and meta-data
-        with tempfile.NamedTemporaryFile(
-            mode="w", delete=False
-        ) as user_data_file, tempfile.NamedTemporaryFile(
-            mode="w", delete=False
-        ) as meta_data_file:
-            user_data_file.write(user_data)
-            meta_data_file.write(meta_data)
-
-            user_data_path = user_data_file.name
-            meta_data_path = meta_data_file.name
-
-        # Add user-data and meta-data files
-        iso.add_file(
-            user_data_path,
+        # Add user-data and meta-data straight from memory
+        user_data_bytes = user_data.encode()
+        meta_data_bytes = meta_data.encode()
+        iso.add_fp(
+            io.BytesIO(user_data_bytes),
+            len(user_data_bytes),
             "/USERDATA.;1",
             joliet_path="/USERDATA.;1",
             rr_name="user-data",
         )
-        iso.add_file(
-            meta_data_path,
+        iso.add_fp(
+            io.BytesIO(meta_data_bytes),
+            len(meta_data_bytes),
             "/METADATA.;1",
             joliet_path="/METADATA.;1",
             rr_name="meta-data",
@@ -294,33 +370,37 @@ local-hostname: {name}
         iso.write(output_iso)
         iso.close()
 
-        # Clean up the temporary files
-        os.remove(user_data_path)
-        os.remove(meta_data_path)
-
     def delete(self, name: str, owner_id: Optional[str] = None) -> None:
         """Delete a local QEMU VM."""
         desktop = DesktopInstance.get(name, owner_id=owner_id)
         if not desktop:
             raise ValueError(f"Desktop '{name}' does not exist.")
 
-        # Find the process by AGENTDESK environment variable
+        # A vm started here is stopped through its handle, which also reaps
+        # it. Others are found by their AGENTDESK environment variable
+        _reap_vms()
         found_process = False
-        for process in psutil.process_iter(["pid", "environ"]):
-            try:
-                env = process.environ()
-                if "AGENTDESK" in env and env["AGENTDESK"] == name:
-                    process.terminate()
-                    process.wait()
-                    found_process = True
-                    break
-            except (
-                psutil.NoSuchProcess,
-                psutil.AccessDenied,
-                psutil.ZombieProcess,
-            ) as e:
-                logger.debug(f"Error accessing process: {e}")
-                continue
+        started = _VM_PROCESSES.pop(name, None)
+        if started is not None:
+            started.terminate()
+            started.wait()
+            found_process = True
+        else:
+            for process in psutil.process_iter(["pid", "environ"]):
+                try:
+                    env = process.environ()
+                    if "AGENTDESK" in env and env["AGENTDESK"] == name:
+                        process.terminate()
+                        process.wait()
+                        found_process = True
+                        break
+                except (
+                    psutil.NoSuchProcess,
+                    psutil.AccessDenied,
+                    psutil.ZombieProcess,
+                ) as e:
+                    logger.debug(f"Error accessing process: {e}")
+                    continue
 
         if not found_process:
             print(
@@ -334,6 +414,9 @@ local-hostname: {name}
         image_path = os.path.join(vm_dir, f"{name}.qcow2")
 
         os.remove(image_path)
+        iso_path = os.path.join(vm_dir, f"{name}-cidata.iso")
+        if os.path.exists(iso_path):
+            os.remove(iso_path)
 
         keys = SSHKeyPair.find(owner_id=owner_id or "local")
         if keys:
@@ -363,7 +446,7 @@ local-hostname: {name}
 
     def list(self) -> List[DesktopInstance]:
         """List local QEMU VMs."""
-        desktops = DesktopInstance.find()
+        desktops = DesktopInstance.find(provider_type="qemu")
         return [
             desktop
             for desktop in desktops
@@ -401,29 +484,34 @@ local-hostname: {name}
 
     def refresh(self, log: bool = True) -> None:
         """Refresh the state of all local QEMU VMs."""
-        desktops = DesktopInstance.find()
+        desktops = DesktopInstance.find(provider_type="qemu")
+        # Exited vms started here would otherwise show up in the scan
+        _reap_vms()
+
+        # Scan the process table once for every vm's AGENTDESK variable,
+        # rather than once per desktop
+        running = set()
+        for process in psutil.process_iter(["pid", "environ"]):
+            try:
+                env = process.environ()
+                if "AGENTDESK" in env:
+                    running.add(env["AGENTDESK"])
+            except (
+                psutil.NoSuchProcess,
+                psutil.AccessDenied,
+                psutil.ZombieProcess,
+            ):
+                continue
 
+        removed = []
         for desktop in desktops:
             if (
                 isinstance(desktop.provider, V1ProviderData)
                 and desktop.provider.type == "qemu"
             ):
-                # Check if the process is still running by AGENTDESK environment variable
-                process_exists = False
-                for process in psutil.process_iter(["pid", "environ"]):
-                    try:
-                        env = process.environ()
-                        if "AGENTDESK" in env and env["AGENTDESK"] == desktop.name:
-                            process_exists = True
-                            break
-                    except (
-                        psutil.NoSuchProcess,
-                        psutil.AccessDenied,
-                        psutil.ZombieProcess,
-                    ):
-                        continue
-
-                if not process_exists:
+                if desktop.name not in running:
                     if log:
                         print(f"removing vm '{desktop.name}' from state")
-                    desktop.remove()
+                    removed.append(desktop.id)
+
+        DesktopInstance.remove_many(removed)
@@ -1,10 +1,13 @@
+import functools
 import io
+import inspect
 import os
 from urllib.parse import urlparse
 import random
 import string
 import subprocess
-from typing import Optional
+import time
+from typing import Optional, Sequence
 import socket
 from subprocess import CalledProcessError, DEVNULL
 from datetime import datetime
@@ -12,9 +15,28 @@ import hashlib
 import base64
 from io import BytesIO
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from google.cloud import storage
 from PIL import Image
 
+# backoff_jitter was added to Retry in urllib3 2.0
+_RETRY_HAS_JITTER = "backoff_jitter" in inspect.signature(Retry.__init__).parameters
+
+# Longest Retry-After honored by retrying sessions, in seconds
+MAX_RETRY_AFTER = 5.0
+
+
+class _CappedRetry(Retry):
+    """Retry which waits at most MAX_RETRY_AFTER for a Retry-After header"""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, MAX_RETRY_AFTER)
+
 
 def b64_to_image(base64_str: str) -> Image.Image:
     """Converts a base64 string to a PIL Image object.
@@ -128,8 +150,13 @@ def get_docker_host() -> str:
         return ""
 
 
+@functools.lru_cache(maxsize=1)
 def find_ssh_public_key() -> Optional[str]:
-    """Try to find the SSH public key in the default location."""
+    """Try to find the SSH public key in the default location.
+
+    The result is kept for the process, call `find_ssh_public_key.cache_clear()`
+    after rotating the key.
+    """
 
     default_ssh_key_path = os.path.expanduser("~/.ssh/id_rsa.pub")
     if os.path.exists(default_ssh_key_path):
@@ -177,6 +204,92 @@ def find_open_port(start_port: int = 1024, end_port: int = 65535) -> Optional[in
     return None  # No open port found
 
 
+def get_free_port() -> int:
+    """Asks the OS for a free ephemeral port"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("", 0))
+        return s.getsockname()[1]
+
+
+def tcp_port_open(host: str, port: int, timeout: float = 2.0) -> bool:
+    """Checks whether a TCP connection to host:port can be opened"""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def wait_for_http(
+    url: str, delays: Sequence[float] = (0.1,) * 5 + (0.2, 0.4, 0.8, 1.6, 3.2, 6.4)
+) -> bool:
+    """Poll a URL with backoff until it responds with a 200.
+
+    Args:
+        url (str): The URL to poll.
+        delays (Sequence[float], optional): Wait between attempts, also used as the request timeout.
+
+    Returns:
+        bool: True if the URL became ready, False otherwise.
+    """
+    for delay in delays:
+        try:
+            if requests.get(url, timeout=delay).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(delay)
+    return False
+
+
+def retrying_session(
+    total: int = 3,
+    backoff_factor: float = 0.3,
+    status_forcelist: Sequence[int] = (502, 503, 504),
+    backoff_jitter: float = 0.3,
+    connect: Optional[int] = None,
+    read: Optional[int] = None,
+    status: Optional[int] = None,
+) -> requests.Session:
+    """Create a requests session which retries failed requests with backoff.
+
+    A ``Retry-After`` header on a retried status, e.g. a 503 while a service is
+    warming up, is honored in place of the backoff, for at most MAX_RETRY_AFTER
+    seconds.
+
+    Args:
+        total (int, optional): Max retries per request. Defaults to 3.
+        backoff_factor (float, optional): Backoff factor between retries. Defaults to 0.3.
+        status_forcelist (Sequence[int], optional): Statuses to retry. Defaults to (502, 503, 504).
+        backoff_jitter (float, optional): Random jitter added to each backoff, needs urllib3 2. Defaults to 0.3.
+        connect (int, optional): Max retries of connection errors, pass 0 when the caller polls and retries itself. Defaults to `total`.
+        read (int, optional): Max retries of read errors, pass 0 when the caller polls and retries itself. Defaults to `total`.
+        status (int, optional): Max retries of `status_forcelist` statuses, pass 0 when the caller polls and retries itself. Defaults to `total`.
+
+    Returns:
+        requests.Session: The session, reuse it to keep connections alive.
+    """
+    kwargs = {}
+    if _RETRY_HAS_JITTER:
+        kwargs["backoff_jitter"] = backoff_jitter
+    retry = _CappedRetry(
+        total=total,
+        connect=connect,
+        read=read,
+        status=status,
+        backoff_factor=backoff_factor,
+        status_forcelist=status_forcelist,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+        **kwargs,
+    )
+    adapter = HTTPAdapter(max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 def convert_unix_to_datetime(unix_timestamp: int) -> str:
     dt = datetime.utcfromtimestamp(unix_timestamp)
     friendly_format = dt.strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# agentdesk reads its home on import, point it at a throwaway one so tests
+# never touch the real database or keys
+os.environ["AGENTSEA_HOME"] = tempfile.mkdtemp(prefix="agentdesk-test-")
@@ -0,0 +1,73 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from agentdesk.runtime.ec2 import CircuitBreaker, CircuitOpen
+
+
+def _response(status_code: int, code=None):
+    parsed = {"Error": {"Code": code}} if code else {}
+    return {"http_response": SimpleNamespace(status_code=status_code), "parsed": parsed}
+
+
+def _fail(breaker: CircuitBreaker, times: int = 1) -> None:
+    for _ in range(times):
+        breaker._after_call(**_response(503))
+
+
+def test_stays_closed_below_threshold():
+    breaker = CircuitBreaker("test", failure_threshold=3)
+    _fail(breaker, 2)
+    breaker._before_call()
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3)
+    _fail(breaker, 2)
+    breaker._after_call_error()
+    with pytest.raises(CircuitOpen):
+        breaker._before_call()
+
+
+def test_client_errors_count_as_success():
+    breaker = CircuitBreaker("test", failure_threshold=3)
+    _fail(breaker, 2)
+    # A rejected request means EC2 is up, it resets the count
+    breaker._after_call(**_response(400, "InvalidInstanceID.NotFound"))
+    _fail(breaker, 2)
+    breaker._before_call()
+
+
+def test_throttling_counts_as_failure():
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    breaker._after_call(**_response(400, "RequestLimitExceeded"))
+    breaker._after_call(**_response(400, "Throttling"))
+    with pytest.raises(CircuitOpen):
+        breaker._before_call()
+
+
+def test_half_open_trial_closes_on_success():
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0.05)
+    _fail(breaker)
+    time.sleep(0.06)
+
+    # One trial goes through, others keep failing fast while it runs
+    breaker._before_call()
+    with pytest.raises(CircuitOpen):
+        breaker._before_call()
+
+    breaker._after_call(**_response(200))
+    breaker._before_call()
+    breaker._before_call()
+
+
+def test_half_open_trial_reopens_on_failure():
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0.05)
+    _fail(breaker)
+    time.sleep(0.06)
+
+    breaker._before_call()
+    _fail(breaker)
+    with pytest.raises(CircuitOpen):
+        breaker._before_call()
@@ -0,0 +1,107 @@
+import json
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from agentdesk.db.models import V1DesktopRecord
+from agentdesk.runtime.base import DesktopInstance
+from agentdesk.server.models import V1ProviderData
+
+
+@pytest.fixture(autouse=True)
+def empty_db():
+    yield
+    DesktopInstance.remove_many([desktop.id for desktop in DesktopInstance.find()])
+
+
+def test_save_inserts_then_updates():
+    desktop = DesktopInstance(
+        name="round-trip",
+        provider=V1ProviderData(type="qemu", args={"a": "b"}),
+        metadata={"k": "v"},
+    )
+    loaded = DesktopInstance.load(desktop.id)
+    assert loaded.name == "round-trip"
+    assert loaded.status == "running"
+    assert loaded.provider == V1ProviderData(type="qemu", args={"a": "b"})
+    assert loaded.metadata == {"k": "v"}
+
+    desktop.status = "stopped"
+    desktop.addr = "10.0.0.1"
+    desktop.save()
+
+    loaded = DesktopInstance.load(desktop.id)
+    assert loaded.status == "stopped"
+    assert loaded.addr == "10.0.0.1"
+    assert len(DesktopInstance.find(name="round-trip")) == 1
+
+
+def test_save_many_updates_existing_and_inserts_new():
+    first = DesktopInstance(name="first")
+    first.status = "stopped"
+    second = DesktopInstance(name="second", save=False)
+
+    DesktopInstance.save_many([first, second])
+
+    assert DesktopInstance.load(first.id).status == "stopped"
+    assert DesktopInstance.load(second.id).name == "second"
+
+
+def test_duplicate_name_raises():
+    DesktopInstance(name="taken")
+    with pytest.raises(IntegrityError):
+        DesktopInstance(name="taken")
+    assert len(DesktopInstance.find(name="taken")) == 1
+
+
+def test_remove_many():
+    desktops = [DesktopInstance(name=f"bulk-{i}") for i in range(3)]
+    kept = DesktopInstance(name="kept")
+
+    removed = DesktopInstance.remove_many([d.id for d in desktops] + ["missing"])
+
+    assert removed == 3
+    assert [d.id for d in DesktopInstance.find()] == [kept.id]
+    assert DesktopInstance.remove_many([]) == 0
+
+
+def _save_legacy(name: str, provider: V1ProviderData) -> DesktopInstance:
+    """Save a desktop the way older versions did, provider via json.dumps"""
+    desktop = DesktopInstance(name=name, save=False)
+    record = desktop.to_record_dict()
+    record["provider"] = json.dumps(provider.__dict__)
+    with DesktopInstance._session() as db:
+        db.add(V1DesktopRecord(**record))
+        db.commit()
+    return desktop
+
+
+def test_find_by_provider_type():
+    gce = DesktopInstance(name="gce", provider=V1ProviderData(type="gce"))
+    legacy_gce = _save_legacy(
+        "legacy-gce", V1ProviderData(type="gce", args={"zone": "us-central1-a"})
+    )
+    DesktopInstance(name="qemu", provider=V1ProviderData(type="qemu"))
+    _save_legacy("legacy-qemu", V1ProviderData(type="qemu"))
+    # A type which only starts with the one looked for
+    DesktopInstance(name="gcex", provider=V1ProviderData(type="gcex"))
+    DesktopInstance(name="no-provider")
+
+    found = DesktopInstance.find(provider_type="gce")
+    assert sorted(d.id for d in found) == sorted([gce.id, legacy_gce.id])
+    assert all(d.provider.type == "gce" for d in found)
+
+    found_v1 = DesktopInstance.find_v1(provider_type="gce")
+    assert sorted(d.id for d in found_v1) == sorted([gce.id, legacy_gce.id])
+
+    assert DesktopInstance.find(provider_type="docker") == []
+
+
+def test_taken_names():
+    DesktopInstance(name="mine", owner_id="me")
+    DesktopInstance(name="theirs", owner_id="them")
+
+    taken = DesktopInstance.taken_names(["mine", "theirs", "free"])
+
+    assert sorted(taken) == ["mine", "theirs"]
+    assert DesktopInstance.taken_names([]) == []
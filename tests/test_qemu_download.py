@@ -0,0 +1,181 @@
+import gzip
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+
+from agentdesk.runtime.qemu import QemuProvider
+
+IMAGE = os.urandom(3 * 1024 * 1024 + 123)
+IMAGE_SHA256 = hashlib.sha256(IMAGE).hexdigest()
+
+
+class _ImageHandler(http.server.BaseHTTPRequestHandler):
+    """Serves IMAGE at /img.qcow2 with Range support, and its sha256.
+
+    Like a compressing server, image bytes are gzipped for clients which
+    accept it.
+    """
+
+    sha256 = IMAGE_SHA256
+    ranges = True
+    requests = []
+    accept_encodings = []
+
+    def do_GET(self):
+        type(self).requests.append((self.path, self.headers.get("Range")))
+        if self.path == "/img.qcow2.sha256":
+            if self.sha256 is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self._send(200, f"{self.sha256}  img.qcow2\n".encode())
+            return
+
+        accept_encoding = self.headers.get("Accept-Encoding", "")
+        type(self).accept_encodings.append(accept_encoding)
+        gzipped = "gzip" in accept_encoding
+
+        byte_range = self.headers.get("Range")
+        if not byte_range or not self.ranges:
+            self._send(200, IMAGE, gzipped)
+            return
+        start = int(byte_range.split("=")[1].rstrip("-"))
+        if start >= len(IMAGE):
+            self._send(416, b"")
+            return
+        self._send(206, IMAGE[start:], gzipped)
+
+    def _send(self, status: int, body: bytes, gzipped: bool = False) -> None:
+        self.send_response(status)
+        if gzipped:
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    handler = type(
+        "Handler", (_ImageHandler,), {"requests": [], "accept_encodings": []}
+    )
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield handler, f"http://127.0.0.1:{httpd.server_port}/img.qcow2"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_download_verifies_and_records_sha256(server, tmp_path):
+    _, url = server
+    path = str(tmp_path / "img.qcow2")
+
+    QemuProvider()._download_image(url, path)
+
+    assert _read(path) == IMAGE
+    assert _read(path + ".sha256").decode() == IMAGE_SHA256
+    assert not os.path.exists(path + ".part")
+
+
+def test_download_resumes_partial_file(server, tmp_path):
+    handler, url = server
+    path = str(tmp_path / "img.qcow2")
+    with open(path + ".part", "wb") as f:
+        f.write(IMAGE[:1000000])
+
+    QemuProvider()._download_image(url, path)
+
+    assert ("/img.qcow2", "bytes=1000000-") in handler.requests
+    assert _read(path) == IMAGE
+    assert _read(path + ".sha256").decode() == IMAGE_SHA256
+
+
+def test_download_asks_for_unencoded_bytes(server, tmp_path):
+    handler, url = server
+    path = str(tmp_path / "img.qcow2")
+    with open(path + ".part", "wb") as f:
+        f.write(IMAGE[:1000000])
+
+    # The server would gzip the image, sizes and offsets only hold unencoded
+    QemuProvider()._download_image(url, path)
+
+    assert handler.accept_encodings == ["identity"]
+    assert _read(path) == IMAGE
+    assert _read(path + ".sha256").decode() == IMAGE_SHA256
+
+
+def test_download_restarts_if_range_is_ignored(server, tmp_path):
+    handler, url = server
+    handler.ranges = False
+    path = str(tmp_path / "img.qcow2")
+    with open(path + ".part", "wb") as f:
+        f.write(b"stale" * 1000)
+
+    QemuProvider()._download_image(url, path)
+
+    assert _read(path) == IMAGE
+
+
+def test_download_restarts_if_partial_file_is_too_long(server, tmp_path):
+    _, url = server
+    path = str(tmp_path / "img.qcow2")
+    with open(path + ".part", "wb") as f:
+        f.write(IMAGE + b"extra")
+
+    QemuProvider()._download_image(url, path)
+
+    assert _read(path) == IMAGE
+
+
+def test_download_rejects_hash_mismatch(server, tmp_path):
+    handler, url = server
+    handler.sha256 = "0" * 64
+    path = str(tmp_path / "img.qcow2")
+
+    with pytest.raises(IOError, match="sha256"):
+        QemuProvider()._download_image(url, path)
+
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + ".part")
+
+
+def test_download_without_published_hash(server, tmp_path):
+    handler, url = server
+    handler.sha256 = None
+    path = str(tmp_path / "img.qcow2")
+
+    QemuProvider()._download_image(url, path)
+
+    assert _read(path) == IMAGE
+    assert _read(path + ".sha256").decode() == IMAGE_SHA256
+
+
+def test_image_current(server, tmp_path):
+    handler, url = server
+    path = str(tmp_path / "img.qcow2")
+    provider = QemuProvider()
+    assert not provider._image_current(url, path)
+
+    # Downloaded before hashes were kept, it is hashed once
+    with open(path, "wb") as f:
+        f.write(IMAGE)
+    assert provider._image_current(url, path)
+    assert _read(path + ".sha256").decode() == IMAGE_SHA256
+
+    # A new image was published under the same url
+    handler.sha256 = "0" * 64
+    assert not provider._image_current(url, path)
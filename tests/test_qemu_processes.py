@@ -0,0 +1,25 @@
+import subprocess
+import sys
+import time
+
+import psutil
+
+from agentdesk.runtime import qemu
+
+
+def test_exited_vm_processes_are_reaped():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    qemu._VM_PROCESSES["reap-me"] = process
+    try:
+        # Until waited on, the exited child stays in the process table
+        deadline = time.monotonic() + 10
+        while psutil.Process(process.pid).status() != psutil.STATUS_ZOMBIE:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        qemu._reap_vms()
+
+        assert "reap-me" not in qemu._VM_PROCESSES
+        assert not psutil.pid_exists(process.pid)
+    finally:
+        qemu._VM_PROCESSES.pop("reap-me", None)
+        process.kill()
@@ -0,0 +1,53 @@
+import itertools
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from agentdesk.runtime import base
+from agentdesk.runtime.base import DesktopProvider, WaitForReadyOptions
+from agentdesk.util import get_free_port
+
+
+def test_delays_start_immediately_and_back_off():
+    options = WaitForReadyOptions(
+        initial_delay=0.5, max_delay=2.0, multiplier=2.0, jitter=False
+    )
+    delays = list(itertools.islice(options.delays(), 6))
+    assert delays == [0.0, 0.5, 1.0, 2.0, 2.0, 2.0]
+
+
+def test_delays_are_jittered_within_bounds():
+    options = WaitForReadyOptions(initial_delay=0.5, max_delay=2.0, multiplier=2.0)
+    first = list(itertools.islice(options.delays(), 50))
+    second = list(itertools.islice(options.delays(), 50))
+    assert first != second
+    assert all(0 <= delay <= options.max_delay for delay in first + second)
+
+
+def test_delays_are_endless():
+    delays = WaitForReadyOptions().delays()
+    assert len(list(itertools.islice(delays, 1000))) == 1000
+
+
+def test_wait_times_out_within_budget():
+    provider = SimpleNamespace(WAIT_FOR_READY=WaitForReadyOptions(timeout=1.0))
+    start = time.monotonic()
+    # Nothing listens on the port, so the ssh precheck never passes
+    with pytest.raises(TimeoutError, match="within 1.0s"):
+        DesktopProvider._wait_till_ready(provider, "127.0.0.1", get_free_port())
+    assert time.monotonic() - start < 2.0
+
+
+def test_wait_bounds_ssh_precheck_by_deadline(monkeypatch):
+    def hanging_connect(host, port, timeout):
+        # A blackholed address, the connect only ends at its timeout
+        time.sleep(timeout)
+        return False
+
+    monkeypatch.setattr(base, "tcp_port_open", hanging_connect)
+    provider = SimpleNamespace(WAIT_FOR_READY=WaitForReadyOptions(timeout=1.0))
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        DesktopProvider._wait_till_ready(provider, "10.255.255.1", 22)
+    assert time.monotonic() - start < 1.5